@@ -22,6 +22,7 @@ async def run_command(cmd):
     """
     cmd_str = ' '.join(cmd)
     print(f"Preloading: {cmd_str}")
+    proc = None
     try:
         # 异步创建子进程
         proc = await asyncio.create_subprocess_exec(
@@ -31,14 +32,15 @@ async def run_command(cmd):
         )
 
         # 等待进程完成，并设置30秒超时
-        await asyncio.wait_for(proc.wait(), timeout=30)
+        async with asyncio.timeout(30):
+            await proc.wait()
 
-    except asyncio.TimeoutError:
+    except TimeoutError:
         print(f"⚠️ Timeout for {cmd[0]} - 可能已缓存")
-        # 如果超时，确保进程被终止
-        if proc.returncode is None:
+        # 如果超时，直接 kill 掉进程并回收，避免残留的 node/deno 僵尸进程占用文件锁
+        if proc is not None and proc.returncode is None:
             try:
-                proc.terminate()
+                proc.kill()
                 await proc.wait()
             except ProcessLookupError:
                 # 进程可能在我们尝试终止它之前就已经结束了
@@ -52,8 +54,8 @@ async def main():
     """
     # 为列表中的每个命令创建一个异步任务
     tasks = [run_command(cmd) for cmd in commands]
-    # 使用 asyncio.gather 并发执行所有任务
-    await asyncio.gather(*tasks)
+    # 使用 asyncio.gather 并发执行所有任务，单个服务器失败不会取消其他预加载
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 if __name__ == "__main__":
     print("最后三个服务器由于配置问题，在非初次Preload时会发生超时，但实际已缓存完毕。")
@@ -1,10 +1,17 @@
 # src/app/api/router.py
+import asyncio
+import functools
+import hashlib
 import logging
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, File, UploadFile, Form, Request
-from typing import Union, Annotated # Annotated 是一个新特性，用于更好地组织依赖项
-import os
+import time
+import orjson
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Any, Callable, Union, Annotated # Annotated 是一个新特性，用于更好地组织依赖项
+from pathlib import Path
 from urllib.parse import urlparse
-from fastapi.concurrency import run_in_threadpool # <--- 导入这个模块
+from concurrent.futures import ThreadPoolExecutor
 from ..schemas import tasks as task_schemas, aippt as aippt_schemas
 from ..services import (
     model_interactor, 
@@ -20,44 +27,228 @@ from ..utils.response_parser import parse_transcription_output # 我们将在下
 
 router = APIRouter(prefix="/api/v1")
 
+# --- 专用线程池 ---
+# 阻塞任务不再使用 Starlette 的默认线程池：IO 型（下载、外部 HTTP 调用）与
+# CPU 型（文档解析）分别走 main.py lifespan 中创建的独立线程池，互不阻塞。
+def get_io_pool(http_request: Request) -> ThreadPoolExecutor:
+    return http_request.app.state.io_pool
+
+def get_cpu_pool(http_request: Request) -> ThreadPoolExecutor:
+    return http_request.app.state.cpu_pool
+
+IoPool = Annotated[ThreadPoolExecutor, Depends(get_io_pool)]
+CpuPool = Annotated[ThreadPoolExecutor, Depends(get_cpu_pool)]
+
+async def _run_in_pool(pool: ThreadPoolExecutor, func: Callable, *args, **kwargs):
+    """在指定线程池中执行阻塞函数，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+# --- 相同请求合并 (singleflight) ---
+# 多个客户端并发提交完全相同的非轮询请求时，只执行一次下载和模型调用，其余请求等待同一结果。
+_inflight: dict[str, asyncio.Task] = {}
+
+def _request_key(endpoint: str, *parts: Any) -> str:
+    """根据端点和请求参数生成稳定的去重键"""
+    canonical = orjson.dumps([endpoint, *parts], option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+def _finish_inflight(key: str, task: asyncio.Task):
+    """共享任务结束后注销；所有等待者都已断开时也要取回异常，避免产生未取回异常的警告"""
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()
+
+async def _run_singleflight(key: str, pool: ThreadPoolExecutor | None, func: Callable, *args, **kwargs):
+    """
+    执行 func：协程函数直接在事件循环中等待（pool 传 None），普通函数在线程池 pool 中执行。
+    若已有相同 key 的请求正在执行，则直接等待其结果。
+    实际执行放在独立的 asyncio.Task 中，首个请求与后续请求一样通过 shield 等待：
+    任何一个请求（包括首个请求）的客户端断开连接，都不会取消其他请求共享的执行。
+    """
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        logging.info(f"检测到重复的进行中请求，复用其结果。key: {key}")
+    else:
+        if pool is None:
+            work = func(*args, **kwargs)
+        else:
+            work = _run_in_pool(pool, func, *args, **kwargs)
+        inflight = asyncio.create_task(work)
+        _inflight[key] = inflight
+        inflight.add_done_callback(functools.partial(_finish_inflight, key))
+    return await asyncio.shield(inflight)
+
+# --- 响应构造 ---
+# 以下内容都由服务端生成，无需再经过 response_model 校验和 jsonable_encoder；
+# 直接返回 Response 时 FastAPI 会跳过这两步，而 response_model 仍保留用于生成文档
+
+def _json_response(content: Any, headers: dict[str, str] | None = None) -> Response:
+    """用 orjson 直接序列化为响应，无法识别的类型按字符串输出"""
+    return Response(content=orjson.dumps(content, default=str), media_type="application/json", headers=headers)
+
+def _final_output(output: Any) -> Response:
+    """直接返回结果时的响应，结构同 FinalOutput"""
+    return _json_response({"output": output})
+
+def _task_created(task_id: str) -> Response:
+    """以轮询模式创建任务时的响应，结构同 TaskCreationResponse"""
+    return _json_response({"task_id": task_id})
+
+def _poll_headers(delay: int) -> dict[str, str]:
+    """未完成任务的轮询提示头"""
+    return {"Retry-After": str(delay), "Cache-Control": f"max-age={delay}"}
+
+_TEXT_STREAM_CHUNK_SIZE = 64 * 1024
+
+def _iter_json_string_body(f, prefix: bytes, suffix: bytes):
+    """
+    将已打开的UTF-8文本文件按块转义为JSON字符串内容，前后拼接 prefix 与 suffix 组成完整的JSON字节流。
+    解码在读取每一块时进行，文件只被读取一次；读取结束后关闭文件。
+    """
+    with f:
+        yield prefix
+        try:
+            while chunk := f.read(_TEXT_STREAM_CHUNK_SIZE):
+                # orjson.dumps 会输出带引号的JSON字符串，去掉首尾引号即为转义后的片段
+                yield orjson.dumps(chunk)[1:-1]
+        except UnicodeDecodeError as e:
+            # 响应头已经发出，只能中断响应；客户端会收到不完整的JSON
+            logging.error(f"流式返回文本文件时发现非UTF-8内容，中断响应: {e}")
+            raise
+        yield suffix
+
 # --- 核心任务轮询端点 ---
 # src/app/api/router.py
 
 # ... (其他导入)
 
+# 终态（COMPLETED/FAILED）任务的响应在清理前不会再变化，
+# 因此由 task_manager 缓存序列化后的字节，避免每次轮询都加锁查询并重新序列化；
+# 缓存项随任务一同被清理或淘汰，过期时间与任务本身的清理时间一致
+
+def _terminal_response(payload: bytes, remaining_seconds: float) -> Response:
+    """构造终态任务的响应，缓存时长与结果剩余的保留时间一致"""
+    return Response(
+        content=payload,
+        media_type="application/json",
+        headers={"Cache-Control": f"private, max-age={max(0, int(remaining_seconds))}"},
+    )
+
+def _read_file_result(result: task_manager.FileResult) -> str | None:
+    """整体读取保存在文件中的任务结果；文件已随任务被清理时返回 None"""
+    try:
+        with open(result.path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _build_task_status(task_id: str, task: dict) -> dict:
+    """
+    将内部任务记录转换为对外的状态响应结构。
+    保存在文件中的结果在这里会被整体读入；单任务查询接口会改为流式返回，不经过这里读取。
+    """
+    status = task['status']
+    result = task.get('result')
+    if isinstance(result, task_manager.FileResult):
+        result = _read_file_result(result)
+    response_data = {"task_id": task_id, "status": status, "result": result}
+    if status == task_manager.TaskStatus.FAILED:
+        response_data['result'] = {"error": task.get('error', '未知错误')}
+    return response_data
+
+def _file_result_response(task_id: str, task: dict, remaining_seconds: float) -> Response:
+    """流式返回保存在文件中的任务结果，结构同 TaskStatusResponse，无需把整个结果读入内存"""
+    try:
+        f = open(task['result'].path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        # 查询期间任务恰好被清理
+        raise HTTPException(status_code=404, detail="任务ID不存在或已过期")
+    prefix = orjson.dumps({"task_id": task_id, "status": task['status']})[:-1] + b',"result":"'
+    return StreamingResponse(
+        _iter_json_string_body(f, prefix, b'"}'),
+        media_type="application/json",
+        headers={"Cache-Control": f"private, max-age={max(0, int(remaining_seconds))}"},
+    )
+
+_TERMINAL_STATUSES = (task_manager.TaskStatus.COMPLETED, task_manager.TaskStatus.FAILED)
+
+# 批量查询接口单次最多接受的任务ID数量
+MAX_BATCH_TASK_IDS = 100
+# execute_mcp 在 Agent 未就绪时最多等待的秒数
+MCP_READY_TIMEOUT = 5
+
+@router.get("/tasks",
+            response_model=dict[str, task_schemas.TaskStatusResponse | None],
+            tags=["Task Management"],
+            summary="批量查询多个异步任务的状态")
+def get_task_statuses(
+    ids: Annotated[list[str], Query(description=f"任务ID列表，可重复传参或用逗号分隔，最多 {MAX_BATCH_TASK_IDS} 个")],
+):
+    """
+    一次请求查询多个任务，返回 {task_id: 状态}；不存在或已过期的任务对应 null。
+    适用于同时发起了多个任务、需要统一轮询的客户端。
+    """
+    task_ids = list(dict.fromkeys(
+        task_id for raw in ids for task_id in raw.split(',') if task_id
+    ))
+    if len(task_ids) > MAX_BATCH_TASK_IDS:
+        raise HTTPException(status_code=414, detail=f"单次最多查询 {MAX_BATCH_TASK_IDS} 个任务，收到 {len(task_ids)} 个。")
+
+    tasks = task_manager.get_tasks(task_ids)
+    statuses = {
+        task_id: _build_task_status(task_id, task) if task else None
+        for task_id, task in tasks.items()
+    }
+    # 若仍有未完成的任务，按其中最短的建议间隔提示客户端下次轮询的时间
+    pending_delays = [
+        task_manager.suggest_poll_interval(task)
+        for task in tasks.values()
+        if task and task['status'] not in _TERMINAL_STATUSES
+    ]
+    return _json_response(statuses, _poll_headers(min(pending_delays)) if pending_delays else None)
+
 @router.get("/tasks/{task_id}", 
-            response_model=task_schemas.TaskStatusResponse, 
+            response_model=task_schemas.TaskStatusResponse,
             tags=["Task Management"],
             summary="查询异步任务的状态")
 def get_task_status(task_id: str):
-    """根据任务ID获取任务的当前状态、结果或错误。"""
+    """
+    根据任务ID获取任务的当前状态、结果或错误。
+    未完成的任务会附带 Retry-After / Cache-Control 头，提示客户端按任务时长逐步放缓轮询。
+    """
+    now = time.monotonic()
+    cached = task_manager.get_cached_response(task_id)
+    if cached:
+        expires_at, payload = cached
+        return _terminal_response(payload, expires_at - now)
+
     task = task_manager.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务ID不存在或已过期")
 
-    status = task['status']
-    response_data = {"task_id": task_id, "status": status, "result": task.get('result')}
-    
     # VVVV  这里是核心修改 VVVV
-    if status == task_manager.TaskStatus.COMPLETED:
-        # 不再立即删除，而是安排在一小时后删除
-        task_manager.schedule_task_cleanup(task_id, delay_seconds=3600)
-        return response_data
-    elif status == task_manager.TaskStatus.FAILED:
-        response_data['result'] = {"error": task.get('error', '未知错误')}
-        # 失败的任务也安排在一小时后删除
-        task_manager.schedule_task_cleanup(task_id, delay_seconds=3600)
-        return response_data
+    if task['status'] in _TERMINAL_STATUSES:
+        # 任务结束时已安排好清理（见 task_manager.finish_task），响应缓存与任务同时过期
+        expires_at = task['expires_at']
+        if isinstance(task['result'], task_manager.FileResult):
+            # 大结果保存在文件中，每次查询都直接从文件流式返回，不缓存其内容
+            return _file_result_response(task_id, task, expires_at - now)
+        response_data = _build_task_status(task_id, task)
+        payload = orjson.dumps(response_data, default=str)
+        task_manager.cache_response(task_id, expires_at, payload)
+        return _terminal_response(payload, expires_at - now)
     # ^^^^  核心修改 ^^^^
     else: # PENDING or PROCESSING
-        return response_data
+        return _json_response(_build_task_status(task_id, task), _poll_headers(task_manager.suggest_poll_interval(task)))
 
 # VVVV 用这个新版本完全替换旧的 analyze_image 函数 VVVV
 @router.post("/vision/analyze",
              response_model=Union[task_schemas.FinalOutput, task_schemas.TaskCreationResponse],
              tags=["AI Services"],
              summary="处理图像和文本输入")
-async def analyze_image(request: task_schemas.VisionRequest, background_tasks: BackgroundTasks):
+async def analyze_image(request: task_schemas.VisionRequest, background_tasks: BackgroundTasks, io_pool: IoPool):
     """
     接收图像URL和文本提示，返回模型分析结果。
     """
@@ -66,13 +257,10 @@ async def analyze_image(request: task_schemas.VisionRequest, background_tasks: B
         try:
             logging.info(f"开始执行 Vision Analysis 任务，URL: {image_url}")
             local_image_path, _ = download_util.download_file(image_url)
-            
-            with open(local_image_path, 'rb') as f:
-                image_content = f.read()
 
             return model_interactor.get_model_response(
                 prompt=prompt,
-                image_bytes_list=[image_content],
+                image_paths=[local_image_path],
                 **model_kwargs
             )
         # ++++ 核心修改：捕获更广泛的异常并提供详细日志 ++++
@@ -87,11 +275,13 @@ async def analyze_image(request: task_schemas.VisionRequest, background_tasks: B
 
     if not request.polling:
         try:
-            # 直接调用
-            result = perform_vision_analysis(
-                request.prompt, str(request.image_url), request.model_kwargs
+            # 在线程池中执行，并合并并发的相同请求
+            key = _request_key("vision/analyze", request.image_url, request.prompt, request.model_kwargs)
+            result = await _run_singleflight(
+                key, io_pool, perform_vision_analysis,
+                request.prompt, request.image_url, request.model_kwargs
             )
-            return task_schemas.FinalOutput(output=result)
+            return _final_output(result)
         # ++++ 核心修改：在API层也捕获所有异常 ++++
         except Exception as e:
             # 将任何在执行过程中发生的错误，都包装成一个清晰的 HTTP 500 响应
@@ -103,44 +293,40 @@ async def analyze_image(request: task_schemas.VisionRequest, background_tasks: B
             task_id, 
             perform_vision_analysis,
             request.prompt,
-            str(request.image_url),
-            request.model_kwargs
+            request.image_url,
+            request.model_kwargs,
+            pool=io_pool,
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        return _task_created(task_id)
 # ... (其他导入和路由)
 
 @router.post("/audio/transcribe",
              response_model=Union[task_schemas.FinalOutput, task_schemas.TaskCreationResponse],
              tags=["AI Services"],
              summary="转写音频文件")
-async def transcribe_audio(http_request: Request, audio_request: task_schemas.AudioRequest, background_tasks: BackgroundTasks):
+async def transcribe_audio(http_request: Request, audio_request: task_schemas.AudioRequest, background_tasks: BackgroundTasks, io_pool: IoPool):
     """
     接收音频URL，返回转写结果。支持自动格式转换和失败重试。
     """
-    def perform_transcription(url: str, opts: task_schemas.TranscriptionOptions):
+    # 在请求入口处将 Pydantic 模型转为字典一次，重试时直接复用
+    options_dict = audio_request.options.as_dict()
+
+    async def perform_transcription(url: str, opts: dict):
         server_base_url = str(http_request.base_url)
-        processed_url, converted_path, original_path = audio_processor.ensure_audio_is_compatible(
-            url, server_base_url
+        # 格式转换（下载 + FFmpeg）是阻塞操作，放入 IO 线程池；提交与轮询火山引擎在事件循环中异步等待
+        processed_url, converted_path = await _run_in_pool(
+            io_pool, audio_processor.ensure_audio_is_compatible, url, server_base_url
         )
         try:
-            # VVVV 核心修改：使用 .model_dump() 将 Pydantic 模型转为字典 VVVV
-            raw_result = volc_client.run_transcription(processed_url, opts.model_dump())
-            # ^^^^ 核心修改 ^^^^
+            raw_result = await volc_client.run_transcription(processed_url, opts)
             return parse_transcription_output(raw_result)
         finally:
-            audio_processor.cleanup_temp_files(converted_path, original_path)
+            audio_processor.cleanup_temp_files(converted_path)
 
     if not audio_request.polling:
         try:
-            # VVVV 核心修改 VVVV
-            # 将阻塞函数放入线程池执行，避免阻塞事件循环
-            result = await run_in_threadpool(
-                perform_transcription, 
-                str(audio_request.audio_url), 
-                audio_request.options
-            )
-            # ^^^^ 核心修改 ^^^^
-            return task_schemas.FinalOutput(output=result)
+            result = await perform_transcription(audio_request.audio_url, options_dict)
+            return _final_output(result)
         except (audio_processor.AudioProcessingError, volc_client.TranscriptionError) as e:
             raise HTTPException(status_code=500, detail=str(e))
     else:
@@ -148,9 +334,9 @@ async def transcribe_audio(http_request: Request, audio_request: task_schemas.Au
         task_id = task_manager.create_task()
         background_tasks.add_task(
             task_manager.run_task_in_background,
-            task_id, perform_transcription, str(audio_request.audio_url), audio_request.options
+            task_id, perform_transcription, audio_request.audio_url, options_dict
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        return _task_created(task_id)
 
 # ... (其他路由)
 @router.post("/mcp/execute",
@@ -160,7 +346,12 @@ async def transcribe_audio(http_request: Request, audio_request: task_schemas.Au
 async def execute_mcp(request: task_schemas.McpRequest, background_tasks: BackgroundTasks):
     """将指令发送给 LangGraph Agent 执行。"""
     if not mcp_agent_manager.is_agent_ready():
-         raise HTTPException(status_code=503, detail="MCP Agent尚未准备就绪，请稍后再试。")
+        # 冷启动期间短暂等待初始化完成，而不是立刻让客户端重试
+        try:
+            async with asyncio.timeout(MCP_READY_TIMEOUT):
+                await mcp_agent_manager.wait_ready()
+        except TimeoutError:
+            raise HTTPException(status_code=503, detail="MCP Agent尚未准备就绪，请稍后再试。")
 
     async def perform_mcp_query(prompt: str):
         return await mcp_agent_manager.process_mcp_query(prompt)
@@ -168,30 +359,17 @@ async def execute_mcp(request: task_schemas.McpRequest, background_tasks: Backgr
     if not request.polling:
         try:
             result = await perform_mcp_query(request.prompt)
-            return task_schemas.FinalOutput(output=result)
+            return _final_output(result)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"MCP Agent 执行失败: {e}")
     else:
         task_id = task_manager.create_task()
-        # 注意：对于async函数，我们直接将其传递给add_task
-        # run_task_in_background 内部会处理 await
-        async def task_wrapper():
-            # 创建一个包装器以适应 run_task_in_background 的同步接口
-            try:
-                result = await perform_mcp_query(request.prompt)
-                with task_manager._task_lock:
-                    task_manager._task_storage[task_id]['status'] = task_manager.TaskStatus.COMPLETED
-                    task_manager._task_storage[task_id]['result'] = result
-            except Exception as e:
-                with task_manager._task_lock:
-                    task_manager._task_storage[task_id]['status'] = task_manager.TaskStatus.FAILED
-                    task_manager._task_storage[task_id]['error'] = str(e)
-
-        # 由于MCP agent的执行是异步的，且已有自己的异常处理，我们直接用background_tasks
-        # 注意：这里的重试逻辑需要由 process_mcp_query 内部实现，或调整 task_manager 以支持 async
-        # 为简单起见，我们暂时直接调用，不经过重试逻辑
-        background_tasks.add_task(task_wrapper)
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        # run_task_in_background 原生支持 async 函数，MCP 任务与其他任务共享重试逻辑
+        background_tasks.add_task(
+            task_manager.run_task_in_background,
+            task_id, perform_mcp_query, request.prompt
+        )
+        return _task_created(task_id)
     
 # VVVV 用下面的新函数完全替换旧的 generate_ppt VVVV
 @router.post("/ppt/generate/from-text",
@@ -200,23 +378,27 @@ async def execute_mcp(request: task_schemas.McpRequest, background_tasks: Backgr
              summary="通过文本直接生成PPT")
 async def generate_ppt_from_text(
     request: aippt_schemas.AipptTextRequest, 
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
 ):
     """
     接收一个JSON请求体，包含文本主题和相关选项，异步生成PPT。
     """
-    options_dict = request.options.model_dump()
+    options_dict = request.options.as_dict()
 
     if not request.polling:
         try:
             # VVVV 核心修改 VVVV
-            result_url = await run_in_threadpool(
+            key = _request_key("ppt/generate/from-text", request.query, options_dict)
+            # generate_ppt 是协程函数，轮询等待期间不占用线程
+            result_url = await _run_singleflight(
+                key,
+                None,
                 aippt_client.generate_ppt, 
                 options=options_dict, 
                 query=request.query
             )
             # ^^^^ 核心修改 ^^^^
-            return task_schemas.FinalOutput(output=result_url)
+            return _final_output(result_url)
         except aippt_client.AipptProcessingError as e:
             raise HTTPException(status_code=500, detail=str(e))
     else:
@@ -226,7 +408,7 @@ async def generate_ppt_from_text(
             task_manager.run_task_in_background,
             task_id, aippt_client.generate_ppt, options=options_dict, query=request.query
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        return _task_created(task_id)
 
 
 # VVVV  用下面的新函数完全替换旧的 generate_ppt_from_file VVVV
@@ -236,30 +418,29 @@ async def generate_ppt_from_text(
              summary="通过文档URL生成PPT (JSON接口)")
 async def generate_ppt_from_file(
     request: aippt_schemas.AipptFileRequest, # <--- 核心改动：接收新的JSON模型
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    io_pool: IoPool,
 ):
     """
     接收一个包含文档URL的JSON，异步生成PPT。
     此版本为适配仅支持application/json的Agent平台。
     """
-    options_dict = request.options.model_dump()
+    options_dict = request.options.as_dict()
 
     # 创建一个健壮的包装函数，处理下载、处理和清理的完整流程
-    def perform_ppt_generation_from_url(url: str, query_str: str | None, opts: dict):
+    async def perform_ppt_generation_from_url(url: str, query_str: str | None, opts: dict):
         local_file_path = None
         try:
             logging.info(f"PPT生成任务：正在从URL下载文件。 URL: {url}")
-            local_file_path, filename = download_util.download_file(url)
+            local_file_path, filename = await _run_in_pool(io_pool, download_util.download_file, url)
             logging.info(f"文件下载成功: {filename}。准备提交给AIPPT服务。")
-            
-            with open(local_file_path, 'rb') as f:
-                content = f.read()
 
-            # 调用现有的、无需修改的服务层函数
-            return aippt_client.generate_ppt(
+            # 在 IO 线程池中读取文件内容；异步客户端上传文件句柄时会在事件循环中同步读盘
+            file_content = await _run_in_pool(io_pool, Path(local_file_path).read_bytes)
+            return await aippt_client.generate_ppt(
                 options=opts,
                 query=query_str,
-                file_content=content,
+                file_content=file_content,
                 file_name=filename
             )
         except Exception as e:
@@ -272,14 +453,17 @@ async def generate_ppt_from_file(
     # --- 任务执行逻辑 ---
     if not request.polling:
         try:
-            # 在线程池中运行阻塞的下载和处理任务
-            result_url = await run_in_threadpool(
+            # 下载在线程池中进行，生成与轮询在事件循环中等待；并合并并发的相同请求
+            key = _request_key("ppt/generate/from-file", request.file_url, request.query, options_dict)
+            result_url = await _run_singleflight(
+                key,
+                None,
                 perform_ppt_generation_from_url,
-                str(request.file_url),
+                request.file_url,
                 request.query,
                 options_dict
             )
-            return task_schemas.FinalOutput(output=result_url)
+            return _final_output(result_url)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
     else: # 轮询模式
@@ -288,11 +472,11 @@ async def generate_ppt_from_file(
             task_manager.run_task_in_background,
             task_id,
             perform_ppt_generation_from_url,
-            str(request.file_url),
+            request.file_url,
             request.query,
             options_dict
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        return _task_created(task_id)
     
 # VVVV 用下面的新函数完全替换旧的 analyze_document_images VVVV
 @router.post("/document/analyze-images",
@@ -301,7 +485,8 @@ async def generate_ppt_from_file(
              summary="通过文档URL解析并分析所有图片 (JSON接口)")
 async def analyze_document_images(
     request: task_schemas.DocumentAnalysisRequest, # <--- 核心改动：接收新的JSON模型
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    cpu_pool: CpuPool,
 ):
     """
     接收一个包含文档URL的JSON，提取其中所有的图片，并结合相应文本进行并发分析。
@@ -316,10 +501,8 @@ async def analyze_document_images(
             logging.info(f"任务开始：正在从URL下载文件。 URL: {url}")
             local_file_path, filename = download_util.download_file(url)
             logging.info(f"文件下载成功: {filename}。准备进行解析。")
-            with open(local_file_path, 'rb') as f:
-                content = f.read()
-            
-            result = target_func(content, filename)
+
+            result = target_func(local_file_path, filename)
             logging.info(f"文档 '{filename}' 分析成功。")
             return result
         except Exception as e:
@@ -332,9 +515,9 @@ async def analyze_document_images(
     # --- 核心改动：简化了主逻辑，不再处理文件上传 ---
     if not request.polling:
         try:
-            # 对于URL的直接请求，我们在线程池中运行包装器
-            result = await run_in_threadpool(task_wrapper_for_url, str(request.file_url))
-            return task_schemas.FinalOutput(output=result)
+            # 对于URL的直接请求，我们在 CPU 线程池中运行包装器
+            result = await _run_in_pool(cpu_pool, task_wrapper_for_url, request.file_url)
+            return _final_output(result)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
     else: # 轮询模式
@@ -343,12 +526,36 @@ async def analyze_document_images(
             task_manager.run_task_in_background, 
             task_id, 
             task_wrapper_for_url, 
-            str(request.file_url)
+            request.file_url,
+            pool=cpu_pool,
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
+        return _task_created(task_id)
     
 # VVVV  在这里添加全新的统一处理接口  VVVV
 
+# 定义文件类型映射：扩展名 -> 任务类型，在模块加载时构建一次
+_AUDIO_EXTS = frozenset({'.wav', '.mp3', '.ogg', '.m4a', '.flac'})
+_IMAGE_EXTS = frozenset({'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp'})
+_DOC_EXTS = frozenset({'.docx', '.pptx', '.pdf', '.xlsx'})
+_TEXT_EXTS = frozenset({'.txt', '.md', '.json', '.xml', '.csv'})
+
+# 转写选项的默认值是固定的，只需计算一次；使用时总是合并出新字典，不会被修改
+_DEFAULT_TRANSCRIPTION_OPTIONS = task_schemas.TranscriptionOptions().as_dict()
+
+_UNIFIED_FILE_KINDS: dict[str, str] = {
+    **dict.fromkeys(_AUDIO_EXTS, "audio"),
+    **dict.fromkeys(_IMAGE_EXTS, "image"),
+    **dict.fromkeys(_DOC_EXTS, "document"),
+    **dict.fromkeys(_TEXT_EXTS, "text"),
+}
+
+@functools.lru_cache(maxsize=1024)
+def _url_ext(url: str) -> str:
+    """解析 URL 路径中文件名的小写扩展名（含点），没有扩展名时返回空字符串"""
+    filename = urlparse(url).path.rpartition('/')[2]
+    i = filename.rfind('.')
+    return filename[i:].lower() if i > 0 else ''
+
 @router.post("/process/unified",
              response_model=Union[task_schemas.FinalOutput, task_schemas.TaskCreationResponse],
              tags=["Unified Services"],
@@ -357,7 +564,9 @@ async def process_unified(
     request: task_schemas.UnifiedProcessingRequest,
     # 我们需要 http_request 来获取服务器的 base_url，用于音频转写后的文件URL生成
     http_request: Request, 
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    io_pool: IoPool,
+    cpu_pool: CpuPool,
 ):
     """
     接收一个包含文件URL的统一请求，并根据文件类型自动分发到相应的服务。
@@ -370,16 +579,16 @@ async def process_unified(
     # --- 辅助函数定义区域 ---
     # 将每种逻辑封装起来，使主流程更清晰
 
-    def _perform_unified_transcription(audio_url: str):
+    async def _perform_unified_transcription(audio_url: str):
         """处理音频转写的完整流程"""
         server_base_url = str(http_request.base_url)
-        processed_url, converted_path, original_path = audio_processor.ensure_audio_is_compatible(
-            audio_url, server_base_url
+        processed_url, converted_path = await _run_in_pool(
+            io_pool, audio_processor.ensure_audio_is_compatible, audio_url, server_base_url
         )
         try:
             # VVVV 核心修改 VVVV
-            # 1. 首先，通过实例化 TranscriptionOptions 模型来获取所有默认值
-            default_options = task_schemas.TranscriptionOptions().model_dump()
+            # 1. 首先，获取 TranscriptionOptions 模型的所有默认值（模块加载时计算一次）
+            default_options = _DEFAULT_TRANSCRIPTION_OPTIONS
 
             # 2. 然后，获取用户可能在 model_kwargs 中提供的覆盖选项
             user_overrides = request.model_kwargs.get("options", {})
@@ -393,22 +602,21 @@ async def process_unified(
             logging.debug(f"最终传递给火山引擎的转写选项: {final_transcription_options}")
 
             # 4. 使用合并后的最终选项执行转写
-            raw_result = volc_client.run_transcription(processed_url, final_transcription_options)
+            raw_result = await volc_client.run_transcription(processed_url, final_transcription_options)
             # ^^^^ 核心修改 ^^^^
             return parse_transcription_output(raw_result)
         finally:
-            audio_processor.cleanup_temp_files(converted_path, original_path)
+            audio_processor.cleanup_temp_files(converted_path)
 
     def _perform_unified_image_analysis(image_url: str, prompt: str):
         """处理图片分析的完整流程"""
         local_image_path = None
         try:
-            local_image_path, _ = download_util.download_file(image_url)
-            with open(local_image_path, 'rb') as f:
-                image_content = f.read()
+            # 使用带缓存的下载，重试或重复请求同一图片时不会再次下载
+            local_image_path, _ = download_util.cached_download(image_url)
             return model_interactor.get_model_response(
                 prompt=prompt,
-                image_bytes_list=[image_content],
+                image_paths=[local_image_path],
                 **request.model_kwargs
             )
         finally:
@@ -420,73 +628,88 @@ async def process_unified(
         local_file_path = None
         try:
             local_file_path, filename = download_util.download_file(doc_url)
-            with open(local_file_path, 'rb') as f:
-                content = f.read()
             # 注意：document_parser.process_document_images 是一个CPU密集型函数
-            # 在非轮询模式下，它会自动被 run_in_threadpool 调用
-            return document_parser.process_document_images(content, filename)
+            # 在非轮询模式下，它会被调度到 CPU 线程池中执行
+            return document_parser.process_document_images(local_file_path, filename)
         finally:
             if local_file_path:
                 download_util.cleanup_temp_file(local_file_path)
 
-    def _perform_unified_text_retrieval(text_url: str):
-        """处理纯文本文件读取的完整流程"""
+    def _download_unified_text(text_url: str) -> str:
+        """下载纯文本文件并分块校验其为合法的UTF-8（不保留内容），返回本地路径"""
         local_file_path = None
         try:
             local_file_path, _ = download_util.download_file(text_url)
             with open(local_file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                while f.read(_TEXT_STREAM_CHUNK_SIZE):
+                    pass
+            return local_file_path
         except Exception as e:
-            # 如果读取失败，也尝试用二进制模式下载并返回错误信息
+            # 如果读取失败，清理临时文件并返回错误信息
             logging.error(f"读取文本文件失败: {e}", exc_info=True)
-            raise IOError(f"无法将文件作为UTF-8文本读取: {e}")
-        finally:
             if local_file_path:
                 download_util.cleanup_temp_file(local_file_path)
+            raise IOError(f"无法将文件作为UTF-8文本读取: {e}")
+
+    def _perform_unified_text_retrieval(text_url: str):
+        """
+        处理纯文本文件读取的完整流程（轮询模式）。
+        任务存储中只保存文件路径，查询结果时再流式读取；文件随任务一同被清理。
+        """
+        return task_manager.FileResult(_download_unified_text(text_url))
 
     # --- 任务调度器主逻辑 ---
 
-    # 1. 从URL中解析出文件扩展名
-    try:
-        parsed_url = urlparse(str(request.file_url))
-        filename = os.path.basename(parsed_url.path)
-        file_ext = os.path.splitext(filename)[1].lower()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"无法解析提供的file_url: {e}")
+    # 1. 从URL中解析出文件扩展名（热门URL的解析结果会被缓存）
+    file_ext = _url_ext(request.file_url)
+    if not file_ext:
+        raise HTTPException(status_code=400, detail="无法从提供的file_url中解析出文件扩展名。")
 
     # 2. 根据文件扩展名确定要执行的目标函数和参数
-    target_func = None
-    args = []
-
-    # 定义文件类型映射
-    AUDIO_EXTS = ('.wav', '.mp3', '.ogg', '.m4a', '.flac')
-    IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
-    DOC_EXTS = ('.docx', '.pptx', '.pdf', '.xlsx')
-    TEXT_EXTS = ('.txt', '.md', '.json', '.xml', '.csv')
-
-    if file_ext in AUDIO_EXTS:
-        target_func = _perform_unified_transcription
-        args = [str(request.file_url)]
-    elif file_ext in IMAGE_EXTS:
-        if not request.INPUT:
-            raise HTTPException(status_code=400, detail="处理图片文件时，必须提供'INPUT'字段作为提示词。")
-        target_func = _perform_unified_image_analysis
-        args = [str(request.file_url), request.INPUT]
-    elif file_ext in DOC_EXTS:
-        target_func = _perform_unified_document_analysis
-        args = [str(request.file_url)]
-    elif file_ext in TEXT_EXTS:
-        target_func = _perform_unified_text_retrieval
-        args = [str(request.file_url)]
-    else:
+    file_kind = _UNIFIED_FILE_KINDS.get(file_ext)
+    if file_kind is None:
         raise HTTPException(status_code=400, detail=f"不支持的文件类型: '{file_ext}'。")
+    if file_kind == "image" and not request.INPUT:
+        raise HTTPException(status_code=400, detail="处理图片文件时，必须提供'INPUT'字段作为提示词。")
+
+    file_url = request.file_url
+    target_func, args = {
+        "audio": (_perform_unified_transcription, [file_url]),
+        "image": (_perform_unified_image_analysis, [file_url, request.INPUT]),
+        "document": (_perform_unified_document_analysis, [file_url]),
+        "text": (_perform_unified_text_retrieval, [file_url]),
+    }[file_kind]
+    # 文档解析走 CPU 线程池，音频转写本身是协程（内部按需使用 IO 线程池），其余走 IO 线程池
+    pool = {"document": cpu_pool, "audio": None}.get(file_kind, io_pool)
 
     # 3. 根据 polling 参数执行任务
-    if not request.polling:
+    if not request.polling and file_kind == "text":
+        # 纯文本直接按块流式返回，响应结构与 FinalOutput 一致，但无需把整个文件读入内存。
+        # 文件只读取一次：边读边校验UTF-8；首块在发出响应头之前读取，明显不是文本的文件仍返回 500
+        local_file_path = None
+        try:
+            local_file_path, _ = await _run_in_pool(io_pool, download_util.download_file, file_url)
+            f = open(local_file_path, 'r', encoding='utf-8')
+            try:
+                first_chunk = await _run_in_pool(io_pool, f.read, _TEXT_STREAM_CHUNK_SIZE)
+            except BaseException:
+                f.close()
+                raise
+        except Exception as e:
+            logging.error(f"统一接口在直接执行模式下失败: {e}", exc_info=True)
+            if local_file_path:
+                download_util.cleanup_temp_file(local_file_path)
+            raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+        return StreamingResponse(
+            _iter_json_string_body(f, b'{"output":"' + orjson.dumps(first_chunk)[1:-1], b'"}'),
+            media_type="application/json",
+            background=BackgroundTask(download_util.cleanup_temp_file, local_file_path),
+        )
+    elif not request.polling:
         try:
-            # 对于IO或CPU密集型任务，使用 run_in_threadpool 避免阻塞事件循环
-            result = await run_in_threadpool(target_func, *args)
-            return task_schemas.FinalOutput(output=result)
+            # 阻塞的处理函数放入对应线程池执行，避免阻塞事件循环
+            result = await target_func(*args) if pool is None else await _run_in_pool(pool, target_func, *args)
+            return _final_output(result)
         except Exception as e:
             logging.error(f"统一接口在直接执行模式下失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
@@ -496,6 +719,7 @@ async def process_unified(
             task_manager.run_task_in_background, 
             task_id, 
             target_func, 
-            *args
+            *args,
+            pool=pool,
         )
-        return task_schemas.TaskCreationResponse(task_id=task_id)
\ No newline at end of file
+        return _task_created(task_id)
\ No newline at end of file
@@ -1,12 +1,73 @@
 # src/app/config.py
 import os
+import copy
 from typing import Dict, Any
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # 获取脚本的基础目录
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(SCRIPT_DIR) # 这将是 'src' 目录
 
+# --- MCP 服务配置模板 ---
+# 定义在模块级别，避免在 Settings 类体中构造大字典；
+# 文件系统服务器的允许目录由 _build_mcp_config 在实例化 Settings 时追加
+_MCP_CONFIG: Dict[str, Any] = {
+    "mcpServers": {
+        "filesystem": {
+            "transport": "stdio",
+            "command": "npx",
+            "args": ["-y", "@modelcontextprotocol/server-filesystem"]
+        },
+        "excel": {
+            "command": "uvx",
+            "args": ["excel-mcp-server", "stdio"]
+        },
+        "word-document-server": {
+            "command": "uvx",
+            "args": ["--from", "office-word-mcp-server", "word_mcp_server"]
+        },
+        "fetch":{
+            "command": "uvx",
+            "args": ["mcp-server-fetch"]
+        },
+        "git":{
+            "command": "uvx",
+            "args": ["mcp-server-git"]
+        },
+        "sequential-thinking": {
+            "transport": "stdio",
+            "command": "npx",
+            "args": ["-y", "@modelcontextprotocol/server-sequential-thinking"]
+        },
+        "time":{
+            "command": "uvx",
+            "args": ["mcp-server-time"]
+        },
+        "memory": {
+            "transport": "stdio",
+            "command": "npx",
+            "args": ["-y", "@modelcontextprotocol/server-memory"]
+        },
+        "Pydantic Run Python":{
+            "transport": "stdio",
+            "command": "deno",
+            "args": ["run","-N","-R=node_modules","-W=node_modules","--node-modules-dir=auto","jsr:@pydantic/mcp-run-python","stdio"]
+        },
+        "context7": {
+            "transport": "stdio",
+            "command": "npx",
+            "args": ["-y", "@upstash/context7-mcp@latest"]
+        },
+    }
+}
+
+def _build_mcp_config(filesystem_allowed_path: str) -> Dict[str, Any]:
+    """基于模板生成一份独立的 MCP 配置，并填入文件系统服务器的允许目录"""
+    config = copy.deepcopy(_MCP_CONFIG)
+    config["mcpServers"]["filesystem"]["args"].append(filesystem_allowed_path)
+    return config
+
 class Settings(BaseSettings):
     # 从项目的根目录（'src' 的上一级）加载 .env 文件
     model_config = SettingsConfigDict(env_file=os.path.join(BASE_DIR, '..', '.env'), extra='ignore')
@@ -35,6 +96,8 @@ class Settings(BaseSettings):
     # --- 音频处理配置 ---
     COMPATIBLE_AUDIO_FORMATS: tuple[str, ...] = ('.wav', '.mp3', '.ogg')
     DOWNLOAD_TIMEOUT: int = 60
+    DOWNLOAD_CACHE_TTL: int = 600 # 按URL缓存下载文件的最长秒数，源站 Cache-Control 更短时以源站为准
+    DOWNLOAD_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
     FFMPEG_TIMEOUT: int = 180
 
     # --- 火山引擎 API 配置 ---
@@ -47,6 +110,12 @@ class Settings(BaseSettings):
     # --- 任务重试配置 ---
     TASK_MAX_RETRIES: int = 3
     TASK_RETRY_DELAY: int = 15
+    TASK_RESULT_TTL: int = 3600 # 任务结束后结果保留的秒数，到期自动清理
+    TASK_RESULT_MAX_ENTRIES: int = 10000 # 最多保留的已结束任务数，超出时提前清理最早过期的结果
+
+    # --- 文档分析配置 ---
+    DOC_ANALYSIS_MAX_WORKERS: int = 32 # 文档图片分析时同时进行的模型调用数上限（所有文档共享）
+    MODEL_CACHE_TTL: int = 0 # 模型响应磁盘缓存的保留秒数；默认 0 不缓存（模型输出带有随机性），需要时显式开启
     
     # --- 新增：MCP 服务配置 ---
     MCP_FILESYSTEM_ALLOWED_PATH: str = "./files"
@@ -55,55 +124,10 @@ class Settings(BaseSettings):
     XF_AIPPT_APP_ID: str | None = None
     XF_AIPPT_API_SECRET: str | None = None
 
-    mcp_config: Dict[str,Any] = {
-    "mcpServers": {
-        "filesystem": {
-            "transport": "stdio",
-            "command": "npx",
-            "args": ["-y", "@modelcontextprotocol/server-filesystem", MCP_FILESYSTEM_ALLOWED_PATH]
-        },
-        "excel": {
-            "command": "uvx",
-            "args": ["excel-mcp-server", "stdio"]
-        },
-        "word-document-server": {
-            "command": "uvx",
-            "args": ["--from", "office-word-mcp-server", "word_mcp_server"]
-        },
-        "fetch":{
-            "command": "uvx",
-            "args": ["mcp-server-fetch"]
-        },
-        "git":{
-            "command": "uvx",
-            "args": ["mcp-server-git"]
-        },
-        "sequential-thinking": {
-            "transport": "stdio",
-            "command": "npx",
-            "args": ["-y", "@modelcontextprotocol/server-sequential-thinking"]
-        },
-        "time":{
-            "command": "uvx",
-            "args": ["mcp-server-time"]
-        },
-        "memory": {
-            "transport": "stdio",
-            "command": "npx",
-            "args": ["-y", "@modelcontextprotocol/server-memory"]
-        },
-        "Pydantic Run Python":{
-            "transport": "stdio",
-            "command": "deno",
-            "args": ["run","-N","-R=node_modules","-W=node_modules","--node-modules-dir=auto","jsr:@pydantic/mcp-run-python","stdio"]
-        },
-        "context7": {
-            "transport": "stdio",
-            "command": "npx",
-            "args": ["-y", "@upstash/context7-mcp@latest"]
-        },
-    }
-    }
+    # 文件系统服务器的允许目录取自上面已校验的 MCP_FILESYSTEM_ALLOWED_PATH，环境变量覆盖同样生效
+    mcp_config: Dict[str,Any] = Field(
+        default_factory=lambda data: _build_mcp_config(data['MCP_FILESYSTEM_ALLOWED_PATH'])
+    )
     
     # (可以放在文件末尾，class 定义之内即可)
 
@@ -2,14 +2,26 @@
 import logging
 import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
  
 from .config import settings
-from .services import mcp_agent_manager
+from .services import aippt_client, document_parser, mcp_agent_manager, task_manager, volc_client
 from .api import router as api_router
 
+def add_background_task(app: FastAPI, coro) -> asyncio.Task:
+    """
+    创建一个受跟踪的后台任务。
+    任务会被保存在 app.state.bg_tasks 中，防止被垃圾回收，并在应用关闭时统一取消。
+    """
+    task = asyncio.create_task(coro)
+    app.state.bg_tasks.add(task)
+    task.add_done_callback(app.state.bg_tasks.discard)
+    return task
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- 应用启动时执行 ---
@@ -28,22 +40,44 @@ async def lifespan(app: FastAPI):
             os.makedirs(dir_path)
             logging.info(f"已创建目录: {dir_path}")
     
-    # 3. 在后台初始化 MCP 服务
+    # 3. 创建专用线程池：CPU 型任务（文档解析）与 IO 型任务（下载、外部 API）分开，互不阻塞
+    app.state.cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="cpu")
+    app.state.io_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="io")
+
+    # 4. 在后台初始化 MCP 服务
     logging.info("应用正在启动，开始初始化 MCP 服务...")
-    asyncio.create_task(mcp_agent_manager.initialize_mcp_and_agent())
+    app.state.bg_tasks = set()
+    add_background_task(app, mcp_agent_manager.initialize_mcp_and_agent())
+
+    # 5. 启动唯一的任务结果过期清理协程
+    add_background_task(app, task_manager.reap_expired_tasks())
     
     yield # 应用在此处运行
     
     # --- 应用关闭时执行 ---
     logging.info("应用正在关闭...")
+    # 取消仍在运行的后台任务（例如尚未完成的 MCP 初始化），并等待它们结束
+    pending_tasks = list(app.state.bg_tasks)
+    for task in pending_tasks:
+        task.cancel()
+    await asyncio.gather(*pending_tasks, return_exceptions=True)
     await mcp_agent_manager.shutdown_mcp_client()
     logging.info("MCP 服务已优雅关闭。")
+    await aippt_client.aclose()
+    await volc_client.aclose()
+    # 文档分析的模型调用在独立的后台事件循环中执行，需在线程池之前停止
+    await asyncio.to_thread(document_parser.shutdown)
+    app.state.cpu_pool.shutdown(wait=False, cancel_futures=True)
+    app.state.io_pool.shutdown(wait=False, cancel_futures=True)
+    logging.info("线程池已关闭。")
 
 app = FastAPI(
     title="多模态 AI 服务器 (重构版)",
     description="一个用于处理视觉、音频和 MCP 任务的服务器，采用现代 FastAPI 架构。",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # 使用 orjson 序列化所有 JSON 响应，大体积的分析结果序列化更快
+    default_response_class=ORJSONResponse,
 )
 
 # 挂载 API 路由
@@ -1,8 +1,9 @@
 # src/app/schemas/aippt.py
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field
 from typing import Literal
+from .base import FrozenOptionsModel, HttpUrlStr
 
-class AipptOptions(BaseModel):
+class AipptOptions(FrozenOptionsModel):
     """定义所有可传递给讯飞AIPPT服务的选项"""
     templateId: str = Field("20240718489569D", description="模板ID")
     author: str | None = Field("默认作者名", description="PPT作者名")
@@ -21,7 +22,7 @@ class AipptTextRequest(BaseModel):
 # VVVV  在这里添加新的模型 VVVV
 class AipptFileRequest(BaseModel):
     """通过文档URL生成PPT的请求模型 (用于JSON请求体)"""
-    file_url: HttpUrl = Field(..., description="用于生成PPT的文档的公开URL")
+    file_url: HttpUrlStr = Field(..., description="用于生成PPT的文档的公开URL")
     query: str | None = Field(None, description="对文档的额外要求或主题概括，可选")
     options: AipptOptions = Field(default_factory=AipptOptions, description="PPT生成的详细选项")
     polling: bool = True
\ No newline at end of file
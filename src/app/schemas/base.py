@@ -0,0 +1,35 @@
+# src/app/schemas/base.py
+from typing import Annotated
+from urllib.parse import urlparse
+from pydantic import AfterValidator, BaseModel, ConfigDict, PrivateAttr
+
+def _check_http_url(url: str) -> str:
+    """只检查协议和主机，不做 HttpUrl 那样完整的解析与规范化"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        raise ValueError('必须是有效的 http/https URL')
+    return url
+
+# 以普通字符串保存的 http/https URL，原样传给下游
+HttpUrlStr = Annotated[str, AfterValidator(_check_http_url)]
+
+class FrozenOptionsModel(BaseModel):
+    """
+    选项类模型的基类。
+    模型冻结后字段不再变化，首次调用 as_dict() 时缓存一份字典形式，处理请求时无需重复调用 model_dump()。
+    model_copy(update=...) 会产生字段不同的新实例，因此副本不沿用原实例的缓存。
+    """
+    model_config = ConfigDict(frozen=True)
+
+    _dump: dict | None = PrivateAttr(default=None)
+
+    def model_copy(self, *, update=None, deep: bool = False):
+        copied = super().model_copy(update=update, deep=deep)
+        copied._dump = None
+        return copied
+
+    def as_dict(self) -> dict:
+        """返回缓存字典的浅拷贝，调用方可以自由修改"""
+        if self._dump is None:
+            self._dump = self.model_dump()
+        return dict(self._dump)
@@ -1,7 +1,8 @@
 # src/app/schemas/volc.py
-from pydantic import BaseModel, Field
+from pydantic import ConfigDict, Field
+from .base import FrozenOptionsModel
 
-class TranscriptionOptions(BaseModel):
+class TranscriptionOptions(FrozenOptionsModel):
     """
     定义所有可传递给火山引擎的音频转写参数。
     这些参数会直接显示在API文档中，方便用户查阅和使用。
@@ -20,6 +21,5 @@ class TranscriptionOptions(BaseModel):
     enable_gender_detection: bool = Field(True, description="开启性别检测")
     vad_segment: bool = Field(False, description="使用VAD分句（默认为语义分句）")
 
-    class Config:
-        # 允许在请求中只提供部分字段，未提供的将使用默认值
-        extra = 'ignore'
\ No newline at end of file
+    # 允许在请求中只提供部分字段，未提供的将使用默认值；模型冻结以保证缓存的字典有效
+    model_config = ConfigDict(extra='ignore', frozen=True)
\ No newline at end of file
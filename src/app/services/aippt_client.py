@@ -1,15 +1,36 @@
 # src/app/services/aippt_client.py
+import asyncio
 import hashlib
 import hmac
 import base64
-import json
 import time
 import logging
-import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
-from typing import IO, Tuple
+import httpx
+import orjson
+from typing import Tuple
 
 from ..config import settings
+from ..utils.http_session import POOL_MAXSIZE
+
+# 模块级共享的异步客户端：创建任务与轮询进度复用到讯飞的 keep-alive 连接，
+# 长达十分钟的轮询等待期间不再占用线程池中的线程。客户端在首次调用时才创建，导入模块时不建立连接池
+_client: httpx.AsyncClient | None = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+        )
+    return _client
+
+async def aclose():
+    """关闭共享客户端，应在应用关闭时调用"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
 
 class AipptProcessingError(Exception):
     """自定义AIPPT处理异常"""
@@ -28,7 +49,7 @@ def _get_signature(app_id: str, api_secret: str, ts: int) -> str:
 
 
 # VVVV  核心修改：重构 _create_task 函数 VVVV
-def _create_task(options: dict, query: str = None, file_content: IO[bytes] = None, file_name: str = None) -> tuple[str, dict]:
+async def _create_task(options: dict, query: str = None, file_content: bytes = None, file_name: str = None) -> tuple[str, dict]:
     """
     提交PPT生成任务到讯飞服务器。
     支持三种输入源：query, file_content, 或 fileUrl (在options中提供)。
@@ -38,14 +59,15 @@ def _create_task(options: dict, query: str = None, file_content: IO[bytes] = Non
     
     signature = _get_signature(settings.XF_AIPPT_APP_ID, settings.XF_AIPPT_API_SECRET, timestamp)
     
-    # 准备表单字段
-    fields = options.copy()
+    # 准备表单字段（值为 None 的选项不提交）
+    fields = {key: value for key, value in options.items() if value is not None}
     if query:
         fields['query'] = query
     
-    # 如果有文件内容，将其添加到表单中
+    # 如果有文件内容，将其添加到表单中；内容需由调用方预先读入（httpx 的异步客户端会在事件循环中同步读取文件句柄）
+    files = None
     if file_content and file_name:
-        fields['file'] = (file_name, file_content, 'application/octet-stream')
+        files = {'file': (file_name, file_content, 'application/octet-stream')}
         fields['fileName'] = file_name
     elif options.get('fileUrl') and 'fileName' in options:
         # 如果提供了 fileUrl，确保 fileName 也存在
@@ -56,21 +78,24 @@ def _create_task(options: dict, query: str = None, file_content: IO[bytes] = Non
         if key in fields and isinstance(fields[key], bool):
             fields[key] = str(fields[key])
 
-    form_data = MultipartEncoder(fields=fields)
-    
+    # multipart 的 Content-Type（含 boundary）由 httpx 生成
     headers = {
         "appId": settings.XF_AIPPT_APP_ID,
         "timestamp": str(timestamp),
         "signature": signature,
-        "Content-Type": form_data.content_type
     }
 
     logging.info("正在向讯飞提交AIPPT创建任务...")
     logging.debug(f"提交的表单字段: {fields.keys()}")
     
-    response = requests.post(url, data=form_data, headers=headers, timeout=60) # 增加超时时间
+    if files is None:
+        # 讯飞接口要求 multipart/form-data；没有文件时把普通字段作为不带文件名的表单项提交
+        files = {key: (None, value) for key, value in fields.items()}
+        fields = None
+
+    response = await _get_client().post(url, data=fields, files=files, headers=headers, timeout=60) # 增加超时时间
     response.raise_for_status()
-    resp_json = response.json()
+    resp_json = orjson.loads(response.content)
     
     logging.info(f"讯飞AIPPT任务创建响应: {resp_json}")
     if resp_json.get('code') == 0:
@@ -78,18 +103,26 @@ def _create_task(options: dict, query: str = None, file_content: IO[bytes] = Non
     else:
         raise AipptProcessingError(f"创建PPT任务失败: {resp_json.get('desc', '未知错误')}")
 
-def _poll_progress(sid: str, headers: dict) -> dict:
+async def _poll_progress(sid: str, headers: dict) -> dict:
     """轮询任务进度"""
     url = f"https://zwapi.xfyun.cn/api/ppt/v2/progress?sid={sid}"
-    # 移除 Content-Type，因为GET请求没有body
-    polling_headers = {k: v for k, v in headers.items() if k.lower() != 'content-type'}
 
-    response = requests.get(url, headers=polling_headers, timeout=10)
+    response = await _get_client().get(url, headers=headers, timeout=10)
     response.raise_for_status()
-    return response.json()
+    return orjson.loads(response.content)
+
+# 轮询间隔：从 0.5 秒开始按 1.3 倍递增，最长 30 秒。
+# 很快完成的任务不必等满固定间隔，耗时长的任务也不会被频繁查询
+POLL_INITIAL_DELAY = 0.5
+POLL_BACKOFF_FACTOR = 1.3
+POLL_MAX_DELAY = 30.0
+
+def _poll_delay(attempt: int) -> float:
+    """第 attempt 次（从 0 开始）轮询后的等待秒数"""
+    return min(POLL_MAX_DELAY, POLL_INITIAL_DELAY * POLL_BACKOFF_FACTOR ** attempt)
 
 # VVVV 核心修改：重构主流程函数 VVVV
-def generate_ppt(options: dict, query: str = None, file_content: IO[bytes] = None, file_name: str = None) -> str:
+async def generate_ppt(options: dict, query: str = None, file_content: bytes = None, file_name: str = None) -> str:
     """
     通用的主流程函数，处理所有类型的PPT生成请求。
     """
@@ -97,14 +130,16 @@ def generate_ppt(options: dict, query: str = None, file_content: IO[bytes] = Non
         raise AipptProcessingError("服务器未配置讯飞AIPPT的APP_ID或API_SECRET。")
 
     # 根据输入源调用 _create_task
-    sid, headers = _create_task(options, query=query, file_content=file_content, file_name=file_name)
+    sid, headers = await _create_task(options, query=query, file_content=file_content, file_name=file_name)
     
     logging.info(f"讯飞任务ID (sid): {sid}，开始轮询进度...")
     
     start_time = time.time()
+    attempt = 0
+    last_statuses = None
     while time.time() - start_time < 600: # 添加一个10分钟的超时，防止无限循环
         try:
-            progress_resp = _poll_progress(sid, headers)
+            progress_resp = await _poll_progress(sid, headers)
             if progress_resp.get('code') != 0:
                 raise AipptProcessingError(f"查询进度失败: {progress_resp.get('desc')}")
 
@@ -125,12 +160,20 @@ def generate_ppt(options: dict, query: str = None, file_content: IO[bytes] = Non
             
             if ppt_status == 'build_failed' or ai_image_status == 'build_failed' or card_note_status == 'build_failed':
                  raise AipptProcessingError("PPT生成过程中某个子任务失败。")
+
+            # 任一子任务状态变化说明任务仍在推进，重新从短间隔开始轮询
+            statuses = (ppt_status, ai_image_status, card_note_status)
+            if statuses != last_statuses:
+                attempt = 0
+                last_statuses = statuses
             
-            time.sleep(5) # 每次轮询后等待5秒，避免过于频繁
+            await asyncio.sleep(_poll_delay(attempt))
+            attempt += 1
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"轮询AIPPT任务进度时发生网络错误: {e}")
-            time.sleep(5) # 网络错误后也等待
+            await asyncio.sleep(_poll_delay(attempt)) # 网络错误后也等待
+            attempt += 1
         except Exception as e:
             # 捕获所有其他异常并终止
             logging.error(f"处理AIPPT任务时发生未知错误: {e}", exc_info=True)
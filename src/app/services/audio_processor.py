@@ -2,31 +2,145 @@
 
 import os
 import uuid
+import shutil
 import logging
 import requests
+import threading
+import time
 import subprocess
+from collections import deque
 from urllib.parse import urlparse
 
 # 从中央配置导入设置
 from ..config import settings
+from ..utils.http_session import create_session
+
+# 模块级共享会话，复用下载音频时的 keep-alive 连接
+_session = create_session()
 
 class AudioProcessingError(Exception):
     """自定义音频处理异常"""
     pass
 
-def ensure_audio_is_compatible(audio_url: str, server_base_url: str) -> tuple[str, str, str]:
+# 兼容格式在导入时固定为小写集合，热路径上只做一次哈希查找
+_COMPATIBLE_AUDIO_FORMATS = frozenset(ext.lower() for ext in settings.COMPATIBLE_AUDIO_FORMATS)
+
+# MP4 系列容器的 moov 元数据常位于文件末尾，FFmpeg 必须能随机读取，
+# 这类格式仍需先完整下载到磁盘；其余格式直接通过管道流式送入 FFmpeg
+_SEEKABLE_INPUT_FORMATS = frozenset({'.m4a', '.mp4', '.mov', '.3gp'})
+_PIPE_CHUNK_SIZE = 64 * 1024
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 只保留 FFmpeg 日志的最后若干行用于排错，内存占用与转换时长无关
+_STDERR_TAIL_LINES = 200
+_STDERR_MAX_LINE_BYTES = 4096
+
+def _start_stderr_reader(proc: subprocess.Popen) -> tuple[deque, threading.Thread]:
+    """在后台线程中持续读取 FFmpeg 的 stderr，只保留最后 _STDERR_TAIL_LINES 行"""
+    tail: deque = deque(maxlen=_STDERR_TAIL_LINES)
+    def _drain():
+        with proc.stderr:
+            # 限制单行长度，异常输出中没有换行时也不会无限增长
+            for line in iter(lambda: proc.stderr.readline(_STDERR_MAX_LINE_BYTES), b''):
+                tail.append(line)
+    reader = threading.Thread(target=_drain, name="ffmpeg-stderr", daemon=True)
+    reader.start()
+    return tail, reader
+
+class _Watchdog:
+    """
+    FFmpeg 看门狗：截止时间到期时直接杀掉进程，阻塞中的 stdin 写入与 wait 随之返回。
+    截止时间可以反复重设：管道写入阶段每写入一块就顺延 DOWNLOAD_TIMEOUT 秒（只限制"无进展"的时长，
+    大文件下载不受总时长限制），写入结束后再给转换阶段 FFMPEG_TIMEOUT 秒，两段预算互不占用。
+    只使用一个后台线程，顺延截止时间时无需唤醒它。
+    """
+    def __init__(self, proc: subprocess.Popen):
+        self._proc = proc
+        self._cond = threading.Condition()
+        self._deadline: float | None = None
+        self._stopped = False
+        self.timed_out_phase: str | None = None # 超时发生的阶段，未超时为 None
+        self._phase = ""
+        self._thread = threading.Thread(target=self._run, name="ffmpeg-watchdog", daemon=True)
+        self._thread.start()
+
+    def arm(self, seconds: float, phase: str):
+        """将截止时间设为 seconds 秒之后"""
+        deadline = time.monotonic() + seconds
+        with self._cond:
+            # 截止时间只是被顺延时，后台线程到期醒来后会重新检查，无需通知
+            need_notify = self._deadline is None or deadline < self._deadline
+            self._deadline = deadline
+            self._phase = phase
+            if need_notify:
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out_phase = self._phase
+                    self._proc.kill()
+                    return
+                self._cond.wait(remaining)
+
+def _ffmpeg_command(input_path: str, converted_filepath: str) -> list[str]:
+    return [
+        # -nostats: 不输出以 \r 刷新的进度行，日志只包含正常换行的消息
+        'ffmpeg', '-hide_banner', '-nostats', '-i', input_path, '-vn',
+        '-acodec', 'libmp3lame', '-q:a', '2', '-y',
+        converted_filepath
+    ]
+
+def _download_to_file(response: requests.Response, filepath: str):
+    # 直接从底层流按 1 MiB 块复制，减少 Python 层的 write 调用次数；
+    # decode_content 保证 gzip 等传输编码仍被解码
+    response.raw.decode_content = True
+    with open(filepath, 'wb') as f:
+        shutil.copyfileobj(response.raw, f, length=_DOWNLOAD_CHUNK_SIZE)
+
+def _pipe_to_ffmpeg(response: requests.Response, proc: subprocess.Popen, watchdog: _Watchdog):
+    """
+    将下载内容逐块写入 FFmpeg 的 stdin；FFmpeg 提前退出（如输入无效）或看门狗超时后停止写入。
+    每写入一块就把截止时间顺延 DOWNLOAD_TIMEOUT 秒，下载或 FFmpeg 长时间没有进展时才会被判定超时。
+    """
+    watchdog.arm(settings.DOWNLOAD_TIMEOUT, "传输")
+    try:
+        for chunk in response.iter_content(chunk_size=_PIPE_CHUNK_SIZE):
+            if watchdog.timed_out_phase is not None:
+                break
+            proc.stdin.write(chunk)
+            watchdog.arm(settings.DOWNLOAD_TIMEOUT, "传输")
+    except BrokenPipeError:
+        logging.warning("FFmpeg 提前关闭了输入管道，停止写入。")
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+def ensure_audio_is_compatible(audio_url: str, server_base_url: str) -> tuple[str, str | None]:
     """
     检查音频格式，如果不兼容则使用FFmpeg下载并转换为MP3。
+    下载内容直接通过管道送入 FFmpeg，不再先落盘（MP4 系列容器除外）。
 
     Args:
         audio_url: 原始音频文件的URL。
         server_base_url: 本服务器的公网访问地址。
 
     Returns:
-        元组 (new_url, converted_path, original_path)。
+        元组 (new_url, converted_path)。
         - new_url: 最终可供API访问的MP3文件URL。
         - converted_path: 转换后文件的本地路径 (如果进行了转换)。
-        - original_path: 下载的原始文件的本地路径 (如果进行了转换)。
 
     Raises:
         AudioProcessingError: 如果下载或转换失败。
@@ -34,57 +148,96 @@ def ensure_audio_is_compatible(audio_url: str, server_base_url: str) -> tuple[st
     parsed_url = urlparse(audio_url)
     file_extension = os.path.splitext(parsed_url.path)[1].lower()
 
-    if file_extension in settings.COMPATIBLE_AUDIO_FORMATS:
+    if file_extension in _COMPATIBLE_AUDIO_FORMATS:
         logging.info(f"音频格式 {file_extension} 兼容，无需转换。")
-        return audio_url, None, None
+        return audio_url, None
 
     logging.warning(f"音频格式 {file_extension} 不兼容，将尝试使用FFmpeg转换为MP3。")
     
     unique_id = uuid.uuid4()
-    original_filename = f"{unique_id}{file_extension}"
     converted_filename = f"{unique_id}.mp3"
-    original_filepath = os.path.join(settings.TEMP_DIR, original_filename)
     converted_filepath = os.path.join(settings.FILES_DIR, converted_filename)
+    # 仅在需要随机读取的容器格式下才使用的暂存文件
+    original_filepath = None
+    proc = None
+    watchdog = None
 
     try:
-        logging.info(f"正在从 {audio_url} 下载文件到 {original_filepath}")
-        with requests.get(audio_url, stream=True, timeout=settings.DOWNLOAD_TIMEOUT) as r:
+        with _session.get(audio_url, stream=True, timeout=settings.DOWNLOAD_TIMEOUT) as r:
             r.raise_for_status()
-            with open(original_filepath, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-        logging.info(f"正在将 {original_filepath} 转换为 {converted_filepath}")
-        command = [
-            'ffmpeg', '-i', original_filepath, '-vn',
-            '-acodec', 'libmp3lame', '-q:a', '2', '-y',
-            converted_filepath
-        ]
-        result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=settings.FFMPEG_TIMEOUT)
+
+            if file_extension in _SEEKABLE_INPUT_FORMATS:
+                original_filepath = os.path.join(settings.TEMP_DIR, f"{unique_id}{file_extension}")
+                logging.info(f"正在从 {audio_url} 下载文件到 {original_filepath}")
+                _download_to_file(r, original_filepath)
+                logging.info(f"正在将 {original_filepath} 转换为 {converted_filepath}")
+                proc = subprocess.Popen(
+                    _ffmpeg_command(original_filepath, converted_filepath),
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+                )
+                watchdog = _Watchdog(proc)
+                watchdog.arm(settings.FFMPEG_TIMEOUT, "转换")
+                stderr_tail, stderr_reader = _start_stderr_reader(proc)
+            else:
+                logging.info(f"正在将 {audio_url} 流式转换为 {converted_filepath}")
+                proc = subprocess.Popen(
+                    _ffmpeg_command('pipe:0', converted_filepath),
+                    stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+                )
+                watchdog = _Watchdog(proc)
+                # 必须在写 stdin 之前开始读取 stderr，否则 stderr 管道写满后两边会互相阻塞
+                stderr_tail, stderr_reader = _start_stderr_reader(proc)
+                _pipe_to_ffmpeg(r, proc, watchdog)
+                # 输入已全部写入，转换阶段单独计时
+                watchdog.arm(settings.FFMPEG_TIMEOUT, "转换")
+
+            # 超时由看门狗负责：到期时进程被杀掉，wait 随之返回
+            proc.wait()
+            stderr_reader.join()
+            if watchdog.timed_out_phase == "传输":
+                raise AudioProcessingError(f"音频数据传输超时（超过 {settings.DOWNLOAD_TIMEOUT} 秒没有进展）。")
+            if watchdog.timed_out_phase is not None:
+                raise subprocess.TimeoutExpired(proc.args, settings.FFMPEG_TIMEOUT)
+            if proc.returncode != 0:
+                stderr = b''.join(stderr_tail).decode('utf-8', errors='replace')
+                logging.error(f"FFmpeg执行失败！\n--- STDERR (最后 {_STDERR_TAIL_LINES} 行) ---\n{stderr}")
+                raise AudioProcessingError("FFmpeg转换音频失败。")
         logging.info("FFmpeg转换成功。")
 
         new_public_url = f"{server_base_url}/files/{converted_filename}"
         logging.info(f"转换后的文件可通过URL访问: {new_public_url}")
         
-        return new_public_url, converted_filepath, original_filepath
+        return new_public_url, converted_filepath
 
+    except AudioProcessingError:
+        cleanup_temp_files(converted_filepath)
+        raise
     except requests.RequestException as e:
+        cleanup_temp_files(converted_filepath)
         raise AudioProcessingError(f"下载音频文件失败: {e}") from e
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg执行失败！\n--- STDERR ---\n{e.stderr}")
-        raise AudioProcessingError("FFmpeg转换音频失败。") from e
     except subprocess.TimeoutExpired:
+        cleanup_temp_files(converted_filepath)
         raise AudioProcessingError("音频转换任务超时。")
     except Exception as e:
         logging.error(f"处理音频时发生未知错误: {e}", exc_info=True)
+        cleanup_temp_files(converted_filepath)
         raise AudioProcessingError(f"未知的音频处理错误: {e}")
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+        # 出错或超时时确保 FFmpeg 子进程不会残留
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        # 暂存的原始文件只在转换时需要；无论成功与否都立即清理
+        cleanup_temp_files(original_filepath)
     
-def cleanup_temp_files(converted_path: str | None, original_path: str | None):
+def cleanup_temp_files(*paths: str | None):
     """清理在处理过程中产生的临时文件"""
-    for path in [converted_path, original_path]:
+    for path in paths:
         if path and os.path.exists(path):
             try:
                 os.remove(path)
                 logging.info(f"已清理临时文件: {path}")
             except OSError as e:
-                logging.error(f"清理临时文件失败: {path}, 错误: {e}")
\ No newline at end of file
+                logging.error(f"清理临时文件失败: {path}, 错误: {e}")
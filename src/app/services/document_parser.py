@@ -1,9 +1,15 @@
 # src/app/services/document_parser.py
-import io
+import asyncio
+import hashlib
 import logging
-from typing import List, Tuple, IO, TypedDict, Generator
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import posixpath
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from itertools import chain
+from typing import Iterator, List, NotRequired, Tuple, TypedDict, Generator
+from concurrent.futures import Future, as_completed
 
 
 # 导入文档解析库
@@ -14,6 +20,7 @@ import fitz  # PyMuPDF
 
 # 导入我们已有的模型处理服务
 from . import model_interactor
+from ..config import settings
 
 class DocumentParsingError(Exception):
     pass
@@ -23,95 +30,383 @@ class DocumentParsingError(Exception):
 # VVVV  NEW HELPER FUNCTION  VVVV
 def _add_separators_for_non_ascii(text: str, limit: int = 2000) -> str:
     """
-    Iterates through text, inserting a separator after 'limit' consecutive non-ASCII characters.
+    Inserts a separator after every 'limit' consecutive non-ASCII characters.
+    The scan runs inside the regex engine instead of a per-character Python loop.
     """
-    new_parts = []
-    non_ascii_counter = 0
-    for char in text:
-        new_parts.append(char)
-        if ord(char) >= 128:  # Character is non-ASCII
-            non_ascii_counter += 1
-            if non_ascii_counter >= limit:
-                new_parts.append("\n----\n")
-                non_ascii_counter = 0
-        else:  # Character is ASCII, so it breaks the sequence
-            non_ascii_counter = 0
-    return "".join(new_parts)
+    # re 模块自带已编译模式的缓存，重复调用不会重新编译
+    pattern = re.compile(f"[^\\x00-\\x7f]{{{limit}}}")
+    return pattern.sub("\\g<0>\n----\n", text)
 # ^^^^ END OF NEW HELPER FUNCTION ^^^^
 
+# 调用模型分析图片的共享事件循环。模型调用是纯网络 IO，在后台线程的事件循环中以协程并发执行，
+# 等待响应时不占用线程；所有文档共用这一个循环和信号量，总并发量不会随同时处理的文档数增长。
+# 循环与线程在第一次提交时才创建，应用关闭时由 shutdown() 停止并回收
+_model_loop: asyncio.AbstractEventLoop | None = None
+_model_thread: threading.Thread | None = None
+_model_semaphore: asyncio.Semaphore | None = None
+_model_loop_lock = threading.Lock()
+
+DOC_ANALYSIS_MODEL = "doubao-seed-1-6-flash-250715"
+
+def _get_model_loop() -> Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]:
+    global _model_loop, _model_thread, _model_semaphore
+    with _model_loop_lock:
+        if _model_loop is None:
+            _model_loop = asyncio.new_event_loop()
+            # 信号量与在该循环中创建的模型客户端都只属于这个循环，随循环一起创建和丢弃
+            _model_semaphore = asyncio.Semaphore(settings.DOC_ANALYSIS_MAX_WORKERS)
+            _model_thread = threading.Thread(target=_model_loop.run_forever, name="doc-model", daemon=True)
+            _model_thread.start()
+        return _model_loop, _model_semaphore
+
+async def _bounded_model_call(semaphore: asyncio.Semaphore, prompt: str, images: List[bytes] | None) -> str:
+    async with semaphore:
+        return await model_interactor.aget_model_response(prompt, images, model=DOC_ANALYSIS_MODEL)
+
+def _submit_model_call(prompt: str, images: List[bytes] | None = None) -> Future:
+    """从工作线程提交一次模型调用，返回可在当前线程中等待的 Future"""
+    loop, semaphore = _get_model_loop()
+    return asyncio.run_coroutine_threadsafe(_bounded_model_call(semaphore, prompt, images), loop)
+
+async def _cancel_pending_calls() -> None:
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.get_running_loop().shutdown_asyncgens()
+
+def shutdown(timeout: float = 5) -> None:
+    """取消仍在进行的模型调用，停止后台事件循环并等待其线程退出。由应用关闭流程调用"""
+    global _model_loop, _model_thread, _model_semaphore
+    with _model_loop_lock:
+        loop, thread = _model_loop, _model_thread
+        _model_loop = _model_thread = _model_semaphore = None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_pending_calls(), loop).result(timeout)
+    except Exception as e:
+        logging.warning(f"取消文档分析的模型调用时出错: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+    if not thread.is_alive():
+        loop.close()
+
+# 分页文档（PPTX/PDF）中含图单元不超过该数量时使用直接输出模式
+DIRECT_OUTPUT_MAX_IMAGE_UNITS = 10
+
 class DocumentUnit(TypedDict):
     unit_identifier: str
     text: str
     images: List[bytes]
+    repeated_image_count: NotRequired[int] # 因与前文重复而被省略的图片数，由提取函数（PDF 按 xref）与 _dedupe_images 累加
+
+def _dedupe_images(units: Iterator[DocumentUnit]) -> Iterator[DocumentUnit]:
+    """
+    按内容（SHA-1）跨单元去重图片：同一张图片（如每页都有的 logo、背景）
+    只保留在首次出现的单元中，避免重复发送给模型分析。
+    """
+    seen: set[bytes] = set()
+    for unit in units:
+        unique_images = []
+        for blob in unit['images']:
+            digest = hashlib.sha1(blob).digest()
+            if digest not in seen:
+                seen.add(digest)
+                unique_images.append(blob)
+        if len(unique_images) < len(unit['images']):
+            logging.info(f"{unit['unit_identifier']}: 跳过 {len(unit['images']) - len(unique_images)} 张已分析过的重复图片。")
+            unit['repeated_image_count'] = unit.get('repeated_image_count', 0) + len(unit['images']) - len(unique_images)
+            unit['images'] = unique_images
+        yield unit
 
 def _chunk_list(data: list, size: int) -> Generator[list, None, None]:
     """一个辅助函数，将列表分割成指定大小的块"""
     for i in range(0, len(data), size):
         yield data[i:i + size]
 
-# --- 提取函数部分（无改动） ---
-
-def _extract_from_pptx(file_stream: IO[bytes]) -> List[DocumentUnit]:
-    presentation = Presentation(file_stream)
-    units: List[DocumentUnit] = []
-    for i, slide in enumerate(presentation.slides):
-        slide_text = "\n".join([shape.text for shape in slide.shapes if shape.has_text_frame]).strip()
-        images = [shape.image.blob for shape in slide.shapes if hasattr(shape, "image")]
-        units.append({
-            "unit_identifier": f"幻灯片 {i + 1}",
-            "text": slide_text,
-            "images": images
-        })
-    logging.info(f"从PPTX中提取了 {len(units)} 个幻灯片单元。")
-    return units
-
-def _extract_from_pdf(file_stream: IO[bytes]) -> List[DocumentUnit]:
-    doc = fitz.open(stream=file_stream, filetype="pdf")
-    units: List[DocumentUnit] = []
-    for i, page in enumerate(doc):
-        page_text = page.get_text("text").strip()
-        images_on_page = []
-        for img in page.get_images(full=True):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            images_on_page.append(base_image["image"])
-        units.append({
-            "unit_identifier": f"页面 {i + 1}",
-            "text": page_text,
-            "images": images_on_page
-        })
-    logging.info(f"从PDF中提取了 {len(units)} 个页面单元。")
-    return units
-
-def _extract_from_docx(file_stream: IO[bytes]) -> List[DocumentUnit]:
-    document = docx.Document(file_stream)
-    full_text = "\n".join([para.text for para in document.paragraphs]).strip()
-    images = [rel.target_part.blob for rel in document.part.rels.values() if "image" in rel.target_ref]
-    unit: DocumentUnit = { "unit_identifier": "文档内容", "text": full_text, "images": images }
+# --- 提取函数部分 ---
+# 各提取函数都是生成器，逐个产出单元，调用方可以边提取边提交分析任务
+
+def _extract_from_pptx(file_path: str) -> Iterator[DocumentUnit]:
+    # 文字与图片都直接从 zip 包中逐张幻灯片读取，图片在产出该幻灯片时才读入内存。
+    # 文字与图片引用都按幻灯片部件路径保存，回退解析时也不会错位到其他幻灯片
+    with zipfile.ZipFile(file_path) as zf:
+        slide_paths = _pptx_slide_paths(zf)
+        slide_texts: dict[str, str] = {}
+        slide_image_ids: dict[str, List[str]] = {}
+        fallback_images: dict[str, List[bytes]] | None = None
+        try:
+            for path in slide_paths:
+                slide = ET.fromstring(zf.read(path))
+                slide_texts[path] = _pptx_slide_text(slide)
+                slide_image_ids[path] = _pptx_slide_image_ids(slide)
+        except ET.ParseError as e:
+            logging.warning(f"流式解析PPTX失败，回退到 python-pptx: {e}")
+            presentation = Presentation(file_path)
+            slide_texts, fallback_images = {}, {}
+            for slide in presentation.slides:
+                path = slide.part.partname.lstrip("/")
+                slide_texts[path] = "\n".join([shape.text for shape in slide.shapes if shape.has_text_frame])
+                fallback_images[path] = [shape.image.blob for shape in slide.shapes if hasattr(shape, "image")]
+            slide_paths = list(slide_texts)
+        count = 0
+        for i, slide_path in enumerate(slide_paths):
+            yield {
+                "unit_identifier": f"幻灯片 {i + 1}",
+                "text": slide_texts[slide_path].strip(),
+                "images": fallback_images[slide_path] if fallback_images is not None
+                          else _read_part_images(zf, slide_path, slide_image_ids[slide_path])
+            }
+            count += 1
+    logging.info(f"从PPTX中提取了 {count} 个幻灯片单元。")
+
+# 文字少于 SCANNED_PAGE_MAX_TEXT_CHARS 个字符且图片多于 SCANNED_PAGE_MIN_IMAGES 张的 PDF 页面按扫描页处理，
+# 以 2 倍缩放整页渲染（A4 约 1190x1684，之后仍会被缩放到模型的输入尺寸）
+SCANNED_PAGE_MAX_TEXT_CHARS = 50
+SCANNED_PAGE_MIN_IMAGES = 5
+_SCANNED_PAGE_MATRIX = fitz.Matrix(2, 2)
+
+def _extract_from_pdf(file_path: str) -> Iterator[DocumentUnit]:
+    with fitz.open(file_path, filetype="pdf") as doc:
+        count = 0
+        seen_xrefs: set[int] = set()
+        for i, page in enumerate(doc):
+            page_text = page.get_text("text").strip()
+            page_images = page.get_images(full=True)
+            images_on_page = []
+            repeated_count = 0
+            if len(page_text) < SCANNED_PAGE_MAX_TEXT_CHARS and len(page_images) > SCANNED_PAGE_MIN_IMAGES:
+                # 扫描件的页面常被切成大量图片碎片，逐张发送给模型只会得到零散的描述；
+                # 直接渲染整页为一张图片，模型看到的是完整页面，调用次数和图片数据量也更少
+                logging.info(f"页面 {i + 1} 文字很少且包含 {len(page_images)} 张图片，按扫描页整页渲染。")
+                pixmap = page.get_pixmap(matrix=_SCANNED_PAGE_MATRIX)
+                images_on_page.append(pixmap.tobytes("jpeg", jpg_quality=85))
+                page_images = []
+            for img in page_images:
+                xref, width, height = img[0], img[2], img[3]
+                # 过小的图片在编码时会被丢弃，直接根据图片字典中的尺寸跳过，无需解码
+                if width < model_interactor.MIN_IMAGE_DIMENSION or height < model_interactor.MIN_IMAGE_DIMENSION:
+                    continue
+                # 同一图片对象（如每页重复的徽标）只提取一次，重复出现本来也会被 _dedupe_images 去掉；
+                # 跳过的次数计入 repeated_image_count，提示词中仍会说明省略了重复图片
+                if xref in seen_xrefs:
+                    repeated_count += 1
+                    continue
+                seen_xrefs.add(xref)
+                base_image = doc.extract_image(xref)
+                images_on_page.append(base_image["image"])
+            unit: DocumentUnit = {
+                "unit_identifier": f"页面 {i + 1}",
+                "text": page_text,
+                "images": images_on_page
+            }
+            if repeated_count:
+                unit['repeated_image_count'] = repeated_count
+            yield unit
+            count += 1
+    logging.info(f"从PDF中提取了 {count} 个页面单元。")
+
+def _extract_from_docx(file_path: str) -> Iterator[DocumentUnit]:
+    with zipfile.ZipFile(file_path) as zf:
+        document_path = _main_part_path(zf)
+        if document_path is None:
+            raise DocumentParsingError("DOCX 文件中缺少主文档部件。")
+        try:
+            full_text = _docx_body_text(zf, document_path)
+        except ET.ParseError as e:
+            logging.warning(f"流式解析DOCX文字失败，回退到 python-docx: {e}")
+            full_text = "\n".join([para.text for para in docx.Document(file_path).paragraphs])
+        full_text = full_text.strip()
+        images = _read_part_images(zf, document_path)
     logging.info(f"从DOCX中提取了 1 个文档单元，包含 {len(images)} 张图片。")
-    return [unit]
-
-def _extract_from_xlsx(file_stream: IO[bytes]) -> List[DocumentUnit]:
-    workbook = openpyxl.load_workbook(file_stream)
-    units: List[DocumentUnit] = []
-    for sheet in workbook.worksheets:
-        unit_identifier = f"工作表 '{sheet.title}'"
-        sheet_text = "\n".join(str(cell.value) for row in sheet.iter_rows() for cell in row if cell.value is not None).strip()
-        images = [image.ref for image in sheet._images] if hasattr(sheet, '_images') else []
-        if sheet_text or images:
-             units.append({ "unit_identifier": unit_identifier, "text": sheet_text, "images": images })
-    logging.info(f"从XLSX中提取了 {len(units)} 个工作表单元。")
-    return units
-
-def process_document_images(file_content: bytes, filename: str) -> str:
+    yield { "unit_identifier": "文档内容", "text": full_text, "images": images }
+
+# --- OOXML 图片定位 ---
+# 直接从 zip 包中沿关系链找出图片，只解析很小的 .rels 文件并读取实际引用的媒体文件，
+# 不必让 python-docx / python-pptx 把整个包（含全部媒体文件）载入内存并构造对象；
+# XLSX 的只读模式更是根本不加载图片
+_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_PRESENTATION_NS = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_R, _W_T, _W_TAB, _W_BR, _W_CR = (f"{_W_NS}{tag}" for tag in ("p", "r", "t", "tab", "br", "cr"))
+_W_HYPERLINK, _W_TYPE = f"{_W_NS}hyperlink", f"{_W_NS}type"
+_A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_A_R, _A_FLD, _A_T, _A_BR = (f"{_A_NS}{tag}" for tag in ("r", "fld", "t", "br"))
+_REL_ID_ATTR = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_R_EMBED_ATTR = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+
+def _read_part_rels(zf: zipfile.ZipFile, part_path: str) -> List[Tuple[str, str, str]]:
+    """读取某个部件的关系文件，返回 [(关系ID, 关系类型, 目标部件路径)]；part_path 为空字符串时读取包级关系"""
+    part_dir, part_name = posixpath.split(part_path)
+    try:
+        root = ET.fromstring(zf.read(posixpath.join(part_dir, "_rels", f"{part_name}.rels")))
+    except KeyError:
+        return []
+    rels = []
+    for rel in root.iter(f"{_REL_NS}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        target_path = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join(part_dir, target))
+        rels.append((rel.get("Id"), rel.get("Type", ""), target_path))
+    return rels
+
+def _main_part_path(zf: zipfile.ZipFile) -> str | None:
+    """返回主文档部件（document.xml / presentation.xml / workbook.xml）的路径"""
+    return next((path for _, rel_type, path in _read_part_rels(zf, "") if rel_type.endswith("/officeDocument")), None)
+
+def _read_part_images(zf: zipfile.ZipFile, part_path: str, rel_ids: List[str] | None = None) -> List[bytes]:
+    """
+    读取某个部件直接引用的图片；同一媒体文件可能被多次引用，按路径去重并保持出现顺序。
+    给出 rel_ids 时只读取这些关系指向的图片，顺序与 rel_ids 一致
+    """
+    image_rels = {rel_id: path for rel_id, rel_type, path in _read_part_rels(zf, part_path) if rel_type.endswith("/image")}
+    if rel_ids is None:
+        media_paths = dict.fromkeys(image_rels.values())
+    else:
+        media_paths = dict.fromkeys(image_rels[rel_id] for rel_id in rel_ids if rel_id in image_rels)
+    return [zf.read(path) for path in media_paths]
+
+def _pptx_slide_paths(zf: zipfile.ZipFile) -> List[str]:
+    """按 presentation.xml 中 sldIdLst 的顺序（与 python-pptx 一致）返回各幻灯片部件的路径"""
+    presentation_path = _main_part_path(zf)
+    if presentation_path is None:
+        return []
+    slide_paths = {rel_id: path for rel_id, _, path in _read_part_rels(zf, presentation_path)}
+    presentation = ET.fromstring(zf.read(presentation_path))
+    return [
+        slide_paths[slide_id.get(_REL_ID_ATTR)]
+        for slide_id in presentation.iter(f"{_PRESENTATION_NS}sldId")
+        if slide_id.get(_REL_ID_ATTR) in slide_paths
+    ]
+
+# --- OOXML 文字提取 ---
+# 与 python-docx 的 paragraph.text、python-pptx 的 shape.text 保持一致的取值规则，
+# 但不为整个文档构建对象树
+
+def _docx_paragraph_text(paragraph: ET.Element) -> str:
+    """段落中直接的文字块（含超链接中的文字块）的文字；制表符为 \t，换行为 \n"""
+    parts = []
+    for child in paragraph:
+        if child.tag == _W_R:
+            runs = (child,)
+        elif child.tag == _W_HYPERLINK:
+            runs = child.findall(_W_R)
+        else:
+            continue
+        for run in runs:
+            for node in run:
+                if node.tag == _W_T:
+                    parts.append(node.text or "")
+                elif node.tag == _W_TAB:
+                    parts.append("\t")
+                elif node.tag == _W_CR or (node.tag == _W_BR and node.get(_W_TYPE, "textWrapping") == "textWrapping"):
+                    parts.append("\n")
+    return "".join(parts)
+
+def _docx_body_text(zf: zipfile.ZipFile, document_path: str) -> str:
+    """流式解析主文档，只取正文（w:body）下的顶层段落；每个顶层元素处理完即释放，内存占用与文档大小无关"""
+    paragraphs = []
+    depth = 0
+    with zf.open(document_path) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            # w:document -> w:body -> 顶层元素，结束时深度回到 2
+            if depth == 2:
+                if elem.tag == _W_P:
+                    paragraphs.append(_docx_paragraph_text(elem))
+                elem.clear()
+    return "\n".join(paragraphs)
+
+def _drawingml_paragraph_text(paragraph: ET.Element) -> str:
+    """DrawingML 段落的文字；软换行为 \v，与 python-pptx 一致"""
+    parts = []
+    for child in paragraph:
+        if child.tag in (_A_R, _A_FLD):
+            parts.append(child.findtext(_A_T) or "")
+        elif child.tag == _A_BR:
+            parts.append("\v")
+    return "".join(parts)
+
+def _pptx_slide_text(slide: ET.Element) -> str:
+    """幻灯片上各顶层文本形状的文字，形状内各段落以换行连接"""
+    shape_tree = slide.find(f"{_PRESENTATION_NS}cSld/{_PRESENTATION_NS}spTree")
+    if shape_tree is None:
+        return ""
+    shape_texts = []
+    for shape in shape_tree.findall(f"{_PRESENTATION_NS}sp"):
+        text_body = shape.find(f"{_PRESENTATION_NS}txBody")
+        if text_body is not None:
+            shape_texts.append("\n".join(_drawingml_paragraph_text(p) for p in text_body.findall(f"{_A_NS}p")))
+    return "\n".join(shape_texts)
+
+def _pptx_slide_image_ids(slide: ET.Element) -> List[str]:
+    """
+    幻灯片上各顶层图片形状（p:pic）的 p:blipFill/a:blip 所引用的关系ID，与 python-pptx 的 slide.shapes 一致；
+    版式、母版、背景填充以及图片填充的形状等其他关系引用的图片不在其中
+    """
+    shape_tree = slide.find(f"{_PRESENTATION_NS}cSld/{_PRESENTATION_NS}spTree")
+    if shape_tree is None:
+        return []
+    blips = shape_tree.findall(f"{_PRESENTATION_NS}pic/{_PRESENTATION_NS}blipFill/{_A_NS}blip")
+    return [blip.get(_R_EMBED_ATTR) for blip in blips if blip.get(_R_EMBED_ATTR)]
+
+def _xlsx_images_by_sheet(file_path: str) -> dict[str, List[bytes]]:
+    """返回 {工作表名: [图片数据]}"""
+    images_by_sheet: dict[str, List[bytes]] = {}
+    with zipfile.ZipFile(file_path) as zf:
+        workbook_path = _main_part_path(zf)
+        if workbook_path is None:
+            return images_by_sheet
+        sheet_paths = {rel_id: path for rel_id, _, path in _read_part_rels(zf, workbook_path)}
+        workbook = ET.fromstring(zf.read(workbook_path))
+        for sheet in workbook.iter(f"{_SHEET_NS}sheet"):
+            sheet_path = sheet_paths.get(sheet.get(_REL_ID_ATTR))
+            if not sheet_path:
+                continue
+            # 同一媒体文件可能被多次引用，按路径去重并保持出现顺序
+            media_paths = dict.fromkeys(
+                media_path
+                for _, rel_type, drawing_path in _read_part_rels(zf, sheet_path) if rel_type.endswith("/drawing")
+                for _, media_type, media_path in _read_part_rels(zf, drawing_path) if media_type.endswith("/image")
+            )
+            if media_paths:
+                images_by_sheet[sheet.get("name")] = [zf.read(path) for path in media_paths]
+    return images_by_sheet
+
+def _extract_from_xlsx(file_path: str) -> Iterator[DocumentUnit]:
+    # 只读模式按行流式解析且不创建带样式的 Cell 对象；data_only 读取公式的缓存结果而非公式文本
+    images_by_sheet = _xlsx_images_by_sheet(file_path)
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        count = 0
+        for sheet in workbook.worksheets:
+            unit_identifier = f"工作表 '{sheet.title}'"
+            cell_values = chain.from_iterable(sheet.iter_rows(values_only=True))
+            sheet_text = "\n".join(str(value) for value in cell_values if value is not None).strip()
+            images = images_by_sheet.get(sheet.title, [])
+            if sheet_text or images:
+                yield { "unit_identifier": unit_identifier, "text": sheet_text, "images": images }
+                count += 1
+        logging.info(f"从XLSX中提取了 {count} 个工作表单元。")
+    finally:
+        # 只读模式会一直持有文件句柄，需要显式关闭
+        workbook.close()
+
+def process_document_images(file_path: str, filename: str) -> str:
     # ... (The entire main logic from the previous step remains exactly the same) ...
     # ... (This includes the dual-branch logic for "direct output" vs "aggregate" modes) ...
     # ...
     # After the `if use_direct_output_mode: ... else: ...` block, you will have the `final_content_parts` list.
     # The code below should be placed right after that block.
     # ...
+    # 直接从本地路径解析，由各解析库按需读取，而不是先把整个文件读入内存
     file_ext = filename.split('.')[-1].lower()
-    file_stream = io.BytesIO(file_content)
 
     extraction_map = {
         'pptx': _extract_from_pptx, 'pdf': _extract_from_pdf,
@@ -120,92 +415,43 @@ def process_document_images(file_content: bytes, filename: str) -> str:
     if file_ext not in extraction_map:
         raise DocumentParsingError(f"不支持的文件类型。当前支持 'pptx', 'pdf', 'docx', 'xlsx'。")
 
-    document_units = extraction_map[file_ext](file_stream)
-    
-    if not any(unit['images'] for unit in document_units):
+    document_units = _dedupe_images(extraction_map[file_ext](file_path))
+    is_unpaginated = file_ext in ('docx', 'xlsx')
+
+    # 预读单元以决定处理模式：分页文档只有在含图单元超过 DIRECT_OUTPUT_MAX_IMAGE_UNITS 个时
+    # 才使用聚合模式，因此最多预读到第 DIRECT_OUTPUT_MAX_IMAGE_UNITS + 1 个含图单元；其余单元边提取边分析
+    buffered_units: List[DocumentUnit] = []
+    image_unit_count = 0
+    for unit in document_units:
+        buffered_units.append(unit)
+        if unit['images']:
+            image_unit_count += 1
+            if is_unpaginated or image_unit_count > DIRECT_OUTPUT_MAX_IMAGE_UNITS:
+                break
+
+    if image_unit_count == 0:
+        # 只有在提取完所有单元后仍未发现图片时才会到达这里
         logging.info("文档中未找到图片，将返回提取的文本内容。")
-        all_texts = [f"--- {unit['unit_identifier']} ---\n{unit['text']}" for unit in document_units if unit['text']]
+        all_texts = [f"--- {unit['unit_identifier']} ---\n{unit['text']}" for unit in buffered_units if unit['text']]
         return f"文档中未找到图片，返回提取的文本内容。\n\n" + "\n\n".join(all_texts)
 
-    units_with_images = [u for u in document_units if u['images']]
-    is_unpaginated = file_ext in ('docx', 'xlsx')
+    use_direct_output_mode = is_unpaginated or image_unit_count <= DIRECT_OUTPUT_MAX_IMAGE_UNITS
+    all_units = chain(buffered_units, document_units)
+    # 最终报告只需要各单元的标识、文本以及是否含图；图片数据在提交分析后即可释放
+    unit_outline: List[Tuple[str, str, bool]] = []
     
-    use_direct_output_mode = is_unpaginated or len(units_with_images) <= 10
-    
-    MAX_WORKERS = 5
     final_content_parts = []
-    
-    if use_direct_output_mode:
-        logging.info(f"激活 [直接输出模式]，因文档类型为 '{file_ext}' 或图片单元数 ({len(units_with_images)}) 不超过10。")
-        DIRECT_ANALYSIS_PROMPT = "你是一个专业的图像分析助手。请详细描述我提供给你的这一批图片的内容。你的描述应该客观、详尽，并使用Markdown格式。不要做任何与图片无关的推断。"
-        
-        analysis_tasks = []
-        for unit in units_with_images:
-            for i, image_chunk in enumerate(_chunk_list(unit['images'], 8)):
-                task_info = (unit['unit_identifier'], i)
-                analysis_tasks.append((DIRECT_ANALYSIS_PROMPT, image_chunk, task_info))
-
-        per_unit_analysis_results = defaultdict(list)
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_info = {
-                executor.submit(model_interactor.get_model_response, prompt, img_bytes, model="doubao-seed-1-6-flash-250715"): info
-                for prompt, img_bytes, info in analysis_tasks
-            }
-            for future in as_completed(future_to_info):
-                unit_identifier, chunk_index = future_to_info[future]
-                try:
-                    result = future.result()
-                    per_unit_analysis_results[unit_identifier].append((chunk_index, result))
-                except Exception as e:
-                    error_message = f"批次 {chunk_index} 分析失败: {e}"
-                    per_unit_analysis_results[unit_identifier].append((chunk_index, error_message))
-
-        for unit in document_units:
-            identifier = unit['unit_identifier']
-            text_part = unit.get('text', '').strip()
-            final_content_parts.append(f"### {identifier}\n\n{text_part if text_part else '此单元无文本内容。'}")
-            if unit['images']:
-                analyses = per_unit_analysis_results.get(identifier)
-                if analyses:
-                    analyses.sort(key=lambda x: x[0])
-                    analysis_texts = [res for _, res in analyses]
-                    combined_analysis = "\n\n".join(analysis_texts)
-                    final_content_parts.append(f"\n--- 图片分析 ---\n\n{combined_analysis}")
-        
-    else:
-        logging.info(f"激活 [聚合分析模式]，因文档类型为 '{file_ext}' 且图片单元数 ({len(units_with_images)}) 超过10。")
-        STAGE1_PROMPT_TEMPLATE = "..." # As before
-        analysis_tasks = []
-        # ... (rest of the aggregate mode logic as before)
-        STAGE1_PROMPT_TEMPLATE = """你是一个专业的文档分析助手。任务是结合我提供的“页面文字”和一组“页面上的图片”，生成对这个页面**当前批次内容**的综合性描述。你的分析应专注于当前提供的信息，并使用Markdown格式排版。尽可能保留原有的所有文字。如果你觉得图片与文字无关，那么请直接输出文字和你对图片的描述。
+
+    DIRECT_ANALYSIS_PROMPT = "你是一个专业的图像分析助手。请详细描述我提供给你的这一批图片的内容。你的描述应该客观、详尽，并使用Markdown格式。不要做任何与图片无关的推断。"
+    STAGE1_PROMPT_TEMPLATE = """你是一个专业的文档分析助手。任务是结合我提供的“页面文字”和一组“页面上的图片”，生成对这个页面**当前批次内容**的综合性描述。你的分析应专注于当前提供的信息，并使用Markdown格式排版。尽可能保留原有的所有文字。如果你觉得图片与文字无关，那么请直接输出文字和你对图片的描述。
 
 ---
 **{unit_identifier}的文字**:
 {text}
 ---
-**{unit_identifier}的图片** (本批次共{image_count}张):
+**{unit_identifier}的图片** (本批次共{image_count}张{repeated_note}):
 [图片内容已提供，请开始分析]"""
-
-        analysis_tasks = []
-        for unit in units_with_images:
-            for i, image_chunk in enumerate(_chunk_list(unit['images'], 8)):
-                prompt = STAGE1_PROMPT_TEMPLATE.format(unit_identifier=unit['unit_identifier'], text=unit['text'], image_count=len(image_chunk))
-                task_info = (unit['unit_identifier'], i)
-                analysis_tasks.append((prompt, image_chunk, task_info))
-
-        per_unit_analysis_results = defaultdict(list)
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_info = {
-                executor.submit(model_interactor.get_model_response, prompt, img_bytes, model="doubao-seed-1-6-flash-250715"): info
-                for prompt, img_bytes, info in analysis_tasks
-            }
-            for future in as_completed(future_to_info):
-                unit_identifier, _ = future_to_info[future]
-                try:
-                    per_unit_analysis_results[unit_identifier].append(future.result())
-                except Exception as e:
-                    per_unit_analysis_results[unit_identifier].append(f"分析失败: {e}")
-        STAGE2_AGGREGATION_PROMPT = """你是一个高级内容编辑。你收到了针对【同一个文档页面/单元】的几份独立分析报告，这是因为该页面的图片过多被分批处理了。你的任务是将这些分散的、描述同一页面的报告，合并成一份最终的、连贯的、完整的分析。
+    STAGE2_AGGREGATION_PROMPT = """你是一个高级内容编辑。你收到了针对【同一个文档页面/单元】的几份独立分析报告，这是因为该页面的图片过多被分批处理了。你的任务是将这些分散的、描述同一页面的报告，合并成一份最终的、连贯的、完整的分析。
 
 请严格遵循以下规则：
 1.  **无缝合并**：消除报告间的重复引言和割裂感，将内容融合成一段流畅的文本。
@@ -219,25 +465,79 @@ def process_document_images(file_content: bytes, filename: str) -> str:
 ---
 请根据以上报告，为【{unit_identifier}】生成最终的、合并后的一份综合性分析。"""
 
-        for unit in document_units:
-            identifier = unit['unit_identifier']
-            if not unit['images']:
-                if unit['text']: final_content_parts.append(f"--- {identifier} (无图片) ---\n{unit['text']}")
-                continue
+    if use_direct_output_mode:
+        logging.info(f"激活 [直接输出模式]，因文档类型为 '{file_ext}' 或图片单元数 ({image_unit_count}) 不超过{DIRECT_OUTPUT_MAX_IMAGE_UNITS}。")
+        build_prompt = lambda unit, image_chunk: DIRECT_ANALYSIS_PROMPT
+    else:
+        logging.info(f"激活 [聚合分析模式]，因文档类型为 '{file_ext}' 且图片单元数超过{DIRECT_OUTPUT_MAX_IMAGE_UNITS}。")
+        build_prompt = lambda unit, image_chunk: STAGE1_PROMPT_TEMPLATE.format(
+            unit_identifier=unit['unit_identifier'], text=unit['text'], image_count=len(image_chunk),
+            repeated_note=f"，另有{unit['repeated_image_count']}张与前文重复的图片已省略" if unit.get('repeated_image_count') else ""
+        )
+
+    # --- 第一阶段：按批次（每批最多 8 张图片）分析，两种模式共用 ---
+    # 每个单元按批次数预先分配结果槽位，结果按批次序号直接写入，天然保持批次顺序
+    future_to_info = {}
+    aggregation_futures: dict[str, Future] = {}
+    analyses_by_unit: dict[str, List[str | None]] = {}
+    try:
+        for unit in all_units:
+            unit_outline.append((unit['unit_identifier'], unit['text'], bool(unit['images'])))
+            image_chunks = list(_chunk_list(unit['images'], 8))
+            if image_chunks:
+                analyses_by_unit[unit['unit_identifier']] = [None] * len(image_chunks)
+            for i, image_chunk in enumerate(image_chunks):
+                future = _submit_model_call(build_prompt(unit, image_chunk), image_chunk)
+                future_to_info[future] = (unit['unit_identifier'], i)
+
+        # 聚合模式下，某个多批次单元的最后一批完成后立即提交其第二阶段合并，
+        # 不必等待其他单元的第一阶段全部结束，两个阶段在不同单元间相互重叠
+        pending_chunks = {identifier: len(slots) for identifier, slots in analyses_by_unit.items()}
+        for future in as_completed(future_to_info):
+            unit_identifier, chunk_index = future_to_info[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = f"批次 {chunk_index} 分析失败: {e}"
+            analyses_by_unit[unit_identifier][chunk_index] = result
+            pending_chunks[unit_identifier] -= 1
+            if not use_direct_output_mode and pending_chunks[unit_identifier] == 0 and len(analyses_by_unit[unit_identifier]) > 1:
+                combined_analyses = "\n\n---\n".join(analyses_by_unit[unit_identifier])
+                final_prompt = STAGE2_AGGREGATION_PROMPT.format(unit_identifier=unit_identifier, combined_analyses=combined_analyses)
+                aggregation_futures[unit_identifier] = _submit_model_call(final_prompt)
+
+        if use_direct_output_mode:
+            for identifier, text, has_images in unit_outline:
+                text_part = text.strip()
+                final_content_parts.append(f"### {identifier}\n\n{text_part if text_part else '此单元无文本内容。'}")
+                if has_images:
+                    analysis_texts = analyses_by_unit.get(identifier)
+                    if analysis_texts:
+                        combined_analysis = "\n\n".join(analysis_texts)
+                        final_content_parts.append(f"\n--- 图片分析 ---\n\n{combined_analysis}")
+        
+        else:
+            # --- 第二阶段：多批次单元的合并调用已在上面随第一阶段的完成陆续提交，这里按原顺序收集 ---
+            for identifier, text, has_images in unit_outline:
+                if not has_images:
+                    if text: final_content_parts.append(f"--- {identifier} (无图片) ---\n{text}")
+                    continue
             
-            analyses = per_unit_analysis_results.get(identifier, [])
-            if len(analyses) == 1:
-                final_content_parts.append(f"### 对 {identifier} 的分析\n{analyses[0]}")
-            elif len(analyses) > 1:
-                combined_analyses = "\n\n---\n".join(analyses)
-                final_prompt = STAGE2_AGGREGATION_PROMPT.format(unit_identifier=identifier, combined_analyses=combined_analyses)
-                try:
-                    aggregated_result = model_interactor.get_model_response(prompt=final_prompt, model="doubao-seed-1-6-flash-250715")
-                    final_content_parts.append(aggregated_result)
-                except Exception as e:
-                    logging.error(f"单元 '{identifier}' 的聚合步骤失败: {e}")
-                    error_header = f"### 对 {identifier} 的分析 (聚合失败)\n\n**错误**: 未能将以下分批报告合并成最终版本。已为您呈现原始报告：\n\n---"
-                    final_content_parts.append(error_header + "\n\n" + combined_analyses)
+                analyses = analyses_by_unit.get(identifier, [])
+                if len(analyses) == 1:
+                    final_content_parts.append(f"### 对 {identifier} 的分析\n{analyses[0]}")
+                elif len(analyses) > 1:
+                    try:
+                        final_content_parts.append(aggregation_futures[identifier].result())
+                    except Exception as e:
+                        logging.error(f"单元 '{identifier}' 的聚合步骤失败: {e}")
+                        error_header = f"### 对 {identifier} 的分析 (聚合失败)\n\n**错误**: 未能将以下分批报告合并成最终版本。已为您呈现原始报告：\n\n---"
+                        final_content_parts.append(error_header + "\n\n" + "\n\n---\n".join(analyses))
+    except BaseException:
+        # 提取或收集过程中出错时，取消已提交但尚未完成的模型调用，避免它们在后台继续占用并发配额
+        for future in chain(future_to_info, aggregation_futures.values()):
+            future.cancel()
+        raise
 
     # --- 最终返回前的后处理步骤 ---
     # VVVV  NEW POST-PROCESSING LOGIC  VVVV
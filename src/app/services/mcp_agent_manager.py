@@ -33,6 +33,8 @@ mcp_config=settings.mcp_config
 # 这些变量将在服务器启动时被填充一次
 mcp_client_instance: Optional[Client] = None
 agent_instance = None
+# Agent 初始化完成后置位，供请求方短暂等待而非直接拒绝
+_ready_event = asyncio.Event()
 
 async def roots_callback(context: RequestContext) -> list[str]:
     print(f"Server requested roots (Request ID: {context.request_id})")
@@ -63,6 +65,7 @@ async def initialize_mcp_and_agent():
         color_print(f"--- [步骤 3] 工具加载成功 ({len(tools)}个)。正在创建 Agent...", "blue")
         llm = ChatArk(model="kimi-k2-250711", max_tokens=32767,api_key=settings.ARK_API_KEY)
         agent_instance = create_react_agent(llm, tools)
+        _ready_event.set()
         
         color_print("--- [成功] MCP Client 和 Agent 已成功启动并准备就绪。", "green")
 
@@ -88,6 +91,7 @@ async def shutdown_mcp_client():
         color_print("--- [关闭] 正在关闭 MCP Client...", "yellow")
         await mcp_client_instance.__aexit__(None, None, None)
         mcp_client_instance = None
+        _ready_event.clear()
         color_print("--- [关闭] MCP Client 已成功关闭。", "green")
 
 async def process_mcp_query(question: str) -> str:
@@ -129,6 +133,10 @@ def is_agent_ready() -> bool:
     """检查 Agent 实例是否已成功初始化"""
     return agent_instance is not None
 
+async def wait_ready():
+    """等待 Agent 初始化完成；调用方应自行设置超时"""
+    await _ready_event.wait()
+
 async def main():
     """
     (修改) 用于独立测试此模块的功能。
@@ -1,140 +1,397 @@
-# src/app/services/model_interactor.py
-import base64
-import io
-import logging
-from typing import List, Optional
-import requests
-from PIL import Image
-from openai import OpenAI
-
-from ..config import settings
-
-class ModelProcessingError(Exception):
-    """自定义模型处理异常"""
-    pass
-
-def _resize_image(image_data: bytes, max_dimension: int = 1024) -> tuple[bytes, str]:
-    """调整图片大小，同时保持其宽高比。"""
-    try:
-        with Image.open(io.BytesIO(image_data)) as img:
-            if img.width <= max_dimension and img.height <= max_dimension:
-                mime_type = Image.MIME.get(img.format)
-                return image_data, mime_type
-
-            if img.width > img.height:
-                new_width = max_dimension
-                new_height = int(max_dimension * img.height / img.width)
-            else:
-                new_height = max_dimension
-                new_width = int(max_dimension * img.width / img.height)
-            
-            logging.info(f"图片尺寸过大 ({img.width}x{img.height})，正在缩放至 ({new_width}x{new_height})...")
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            output_buffer = io.BytesIO()
-            image_format = img.format or 'JPEG' 
-            resized_img.save(output_buffer, format=image_format)
-            
-            mime_type = Image.MIME.get(image_format)
-            return output_buffer.getvalue(), mime_type
-    except Exception as e:
-        raise ModelProcessingError(f"图片缩放失败: {e}") from e
-
-
-# VVVV 用这个新版本替换旧的 _encode_image_bytes VVVV
-def _encode_image_bytes(image_data: bytes, min_dimension: int = 14) -> Optional[str]:
-    """
-    将二进制图片数据缩放并编码为 Base64 Data URL。
-    新增：在处理前检查图片尺寸，过滤掉太小的图片。
-    """
-    try:
-        # --- 核心修改：在这里进行尺寸校验 ---
-        with Image.open(io.BytesIO(image_data)) as img:
-            if img.width < min_dimension or img.height < min_dimension:
-                logging.warning(f"跳过图片，因为其尺寸 ({img.width}x{img.height}) 过小。最小要求: {min_dimension}px。")
-                return None # 返回 None 表示此图片无效，应被跳过
-        # --- 修改结束 ---
-
-        logging.info("正在处理二进制图片数据...")
-        resized_image_data, mime_type = _resize_image(image_data)
-        logging.info("图片处理完成，正在进行 Base64 编码...")
-        base64_encoded_string = base64.b64encode(resized_image_data).decode("utf-8")
-        return f"data:{mime_type};base64,{base64_encoded_string}"
-    except Exception as e:
-        # 如果图片本身已损坏无法打开，也当作无效图片处理
-        logging.error(f"处理图片时发生错误，将跳过此图: {e}")
-        return None
-"""
-def _download_and_encode_image(url: str) -> str:
-    从 URL 下载图片，缩放，并编码为 Base64 Data URL。
-    try:
-        headers = {'User-Agent': 'MyAnalysisServer/1.0'}
-        logging.info(f"正在从 URL 下载图片: {url}")
-        response = requests.get(url, headers=headers, stream=True, timeout=15)
-        response.raise_for_status()
-        
-        original_image_data = response.content
-        logging.info("图片下载成功，正在处理...")
-        
-        resized_image_data, mime_type = _resize_image(original_image_data)
-        
-        logging.info("图片处理完成，正在进行 Base64 编码...")
-        base64_encoded_string = base64.b64encode(resized_image_data).decode("utf-8")
-        
-        return f"data:{mime_type};base64,{base64_encoded_string}"
-    except requests.exceptions.RequestException as e:
-        raise ModelProcessingError(f"下载图片失败，URL: {url}") from e
-    except Exception as e:
-        # 这会捕获 _resize_image 抛出的 ModelProcessingError
-        raise ModelProcessingError(f"处理图片时发生错误: {e}") from e
-"""
-# VVVV  核心修改：函数现在接受一个图片列表 VVVV
-def get_model_response(prompt: str, image_bytes_list: List[bytes] = None, **kwargs) -> str:
-    """
-    主函数，处理文本和一系列二进制图片，并获取模型响应。
-    """
-    final_api_key = kwargs.get('api_key') or settings.OPENAI_API_KEY
-    final_base_url = kwargs.get('base_url') or settings.OPENAI_API_BASE_URL
-    final_model = kwargs.get('model') or settings.MODEL_NAME
-
-    if not final_api_key or not final_base_url:
-        raise ModelProcessingError("API 密钥或基地址未在服务器上配置。")
-
-    try:
-        content = [{"type": "text", "text": prompt}]
-        
-        valid_image_urls = []
-        if image_bytes_list:
-            for img_bytes in image_bytes_list:
-                # base64_image_url 现在可能是 str 或 None
-                base64_image_url = _encode_image_bytes(img_bytes)
-                if base64_image_url:
-                    valid_image_urls.append(base64_image_url)
-
-        for url in valid_image_urls:
-            content.append(
-                {"type": "image_url", "image_url": {"url": url}}
-            )
-        
-        # 如果所有图片都被过滤掉了，打印一条日志
-        if image_bytes_list and not valid_image_urls:
-            logging.warning("警告：此批次的所有图片都因尺寸过小或格式错误而被跳过。")
-            # 如果不希望在这种情况下调用模型，可以在这里直接返回一个提示信息
-            # return "文档单元中的所有图片都无效，无法进行分析。"
-
-        logging.info(f"向模型 '{final_model}' 发送请求，包含 {len(valid_image_urls)} 张有效图片。")
-        
-        client = OpenAI(api_key=final_api_key, base_url=final_base_url)
-        response = client.chat.completions.create(
-            model=final_model,
-            messages=[{"role": "user", "content": content}],
-            max_tokens=kwargs.get('max_tokens', 4096),
-        )
-        logging.info("成功获得模型返回结果。")
-        return response.choices[0].message.content
-
-    except ModelProcessingError as e:
-        raise e
-    except Exception as e:
-        logging.error(f"调用模型API时发生未知错误: {e}", exc_info=True)
-        raise ModelProcessingError(f"调用模型API时发生严重错误: {e}") from e
\ No newline at end of file
+# src/app/services/model_interactor.py
+import asyncio
+import base64
+import functools
+import io
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Union
+import orjson
+import requests
+from PIL import Image
+from openai import OpenAI, AsyncOpenAI
+
+from ..config import settings
+
+class ModelProcessingError(Exception):
+    """自定义模型处理异常"""
+    pass
+
+# 图片来源：既可以是内存中的二进制数据，也可以是本地文件路径
+ImageSource = Union[bytes, str]
+
+# 宽或高小于该像素数的图片不会发送给模型
+MIN_IMAGE_DIMENSION = 14
+
+# 按图片内容哈希缓存编码结果（Data URL，或表示无效图片的 None），
+# 重复的图片（跨请求的同一份文档、各页重复的图标等）无需再次解码、缩放和 Base64 编码。
+# 按编码结果的总字节数淘汰最久未使用的条目
+_ENCODE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_encode_cache: "OrderedDict[bytes, Optional[str]]" = OrderedDict()
+_encode_cache_bytes = 0
+_encode_cache_lock = threading.Lock()
+
+def _open_image(image_data: ImageSource) -> Image.Image:
+    """打开图片。传入路径时由 Pillow 直接按需读取文件，避免先整体读入内存。"""
+    if isinstance(image_data, str):
+        return Image.open(image_data)
+    return Image.open(io.BytesIO(image_data))
+
+def _read_image_bytes(image_data: ImageSource) -> bytes:
+    """获取图片的原始二进制数据"""
+    if isinstance(image_data, str):
+        with open(image_data, 'rb') as f:
+            return f.read()
+    return image_data
+
+def _resize_image(img: Image.Image, image_data: ImageSource, max_dimension: int = 1024) -> tuple[bytes, str]:
+    """
+    调整已打开图片的大小，同时保持其宽高比。
+    尺寸未超限时直接返回原始数据，不重新编码。
+    """
+    try:
+        if img.width <= max_dimension and img.height <= max_dimension:
+            mime_type = Image.MIME.get(img.format)
+            return _read_image_bytes(image_data), mime_type
+
+        if img.width > img.height:
+            new_width = max_dimension
+            new_height = int(max_dimension * img.height / img.width)
+        else:
+            new_height = max_dimension
+            new_width = int(max_dimension * img.width / img.height)
+        
+        logging.info(f"图片尺寸过大 ({img.width}x{img.height})，正在缩放至 ({new_width}x{new_height})...")
+        # 缩小倍数不到 2 倍时 BILINEAR 与 LANCZOS 的效果几乎没有差别，但要快得多；
+        # 倍数更大时仍用 LANCZOS 避免锯齿，并先用 reducing_gap 做一次快速的整数倍缩小
+        scale = max(img.width, img.height) / max_dimension
+        if scale < 2:
+            resized_img = img.resize((new_width, new_height), Image.Resampling.BILINEAR)
+        else:
+            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        
+        output_buffer = io.BytesIO()
+        has_alpha = 'A' in resized_img.getbands() or 'transparency' in resized_img.info
+        if has_alpha:
+            # 带透明通道的图片保持原格式（JPEG 无法保存透明度）
+            image_format = img.format if img.format and img.format != 'JPEG' else 'PNG'
+            resized_img.save(output_buffer, format=image_format)
+        else:
+            # 不透明的图片（包括截图等 PNG）统一编码为 JPEG，体积通常只有 PNG 的几分之一，
+            # Base64 后的请求更小，上传与模型处理都更快
+            image_format = 'JPEG'
+            if resized_img.mode not in ('RGB', 'L'):
+                resized_img = resized_img.convert('RGB')
+            resized_img.save(output_buffer, format=image_format, quality=85, optimize=True)
+        
+        mime_type = Image.MIME.get(image_format)
+        return output_buffer.getvalue(), mime_type
+    except Exception as e:
+        raise ModelProcessingError(f"图片缩放失败: {e}") from e
+
+
+def _encode_image_cached(image_data: bytes) -> Optional[str]:
+    """带内容哈希缓存的 _encode_image_bytes，仅用于内存中的图片数据"""
+    global _encode_cache_bytes
+    digest = hashlib.blake2b(image_data, digest_size=16).digest()
+    with _encode_cache_lock:
+        if digest in _encode_cache:
+            _encode_cache.move_to_end(digest)
+            return _encode_cache[digest]
+
+    data_url = _encode_image_bytes(image_data)
+
+    size = len(data_url) if data_url else 0
+    if size > _ENCODE_CACHE_MAX_BYTES:
+        return data_url
+    with _encode_cache_lock:
+        if digest not in _encode_cache:
+            _encode_cache[digest] = data_url
+            _encode_cache_bytes += size
+            while _encode_cache_bytes > _ENCODE_CACHE_MAX_BYTES:
+                _, evicted = _encode_cache.popitem(last=False)
+                _encode_cache_bytes -= len(evicted) if evicted else 0
+    return data_url
+
+# JPEG 中携带图片尺寸的 SOF 段标记（排除 DHT/JPG/DAC 这几个同区间的非 SOF 标记）
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _peek_dimensions(data: bytes) -> Optional[tuple[int, int]]:
+    """
+    直接从文件头读取 PNG / GIF / JPEG 的宽高，无需 Pillow。
+    无法识别的格式返回 None，由调用方交给 Pillow 处理。
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little')
+    if data[:2] == b'\xff\xd8':
+        # 逐段跳过，直到遇到 SOF 段：FF marker len(2) precision(1) height(2) width(2)
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF: # 填充字节
+                i += 1
+                continue
+            if marker in _JPEG_SOF_MARKERS:
+                return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+            if marker == 0x01 or 0xD0 <= marker <= 0xD9: # 没有长度字段的独立标记
+                i += 2
+                continue
+            i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+# VVVV 用这个新版本替换旧的 _encode_image_bytes VVVV
+def _encode_image_bytes(image_data: ImageSource, min_dimension: int = MIN_IMAGE_DIMENSION) -> Optional[str]:
+    """
+    将二进制图片数据（或本地图片文件）缩放并编码为 Base64 Data URL。
+    新增：在处理前检查图片尺寸，过滤掉太小的图片。
+    """
+    try:
+        # 常见格式先直接从文件头读取尺寸，过小的图片（图标、装饰线等）无需创建 Pillow 对象即可跳过
+        if isinstance(image_data, bytes):
+            dimensions = _peek_dimensions(image_data)
+            if dimensions and (dimensions[0] < min_dimension or dimensions[1] < min_dimension):
+                logging.warning(f"跳过图片，因为其尺寸 ({dimensions[0]}x{dimensions[1]}) 过小。最小要求: {min_dimension}px。")
+                return None
+
+        # 图片只打开（解析文件头）一次，尺寸校验与缩放共用同一个 Image 对象
+        with _open_image(image_data) as img:
+            # --- 核心修改：在这里进行尺寸校验 ---
+            if img.width < min_dimension or img.height < min_dimension:
+                logging.warning(f"跳过图片，因为其尺寸 ({img.width}x{img.height}) 过小。最小要求: {min_dimension}px。")
+                return None # 返回 None 表示此图片无效，应被跳过
+            # --- 修改结束 ---
+
+            logging.info("正在处理二进制图片数据...")
+            resized_image_data, mime_type = _resize_image(img, image_data)
+        logging.info("图片处理完成，正在进行 Base64 编码...")
+        base64_encoded_string = base64.b64encode(resized_image_data).decode("utf-8")
+        return f"data:{mime_type};base64,{base64_encoded_string}"
+    except Exception as e:
+        # 如果图片本身已损坏无法打开，也当作无效图片处理
+        logging.error(f"处理图片时发生错误，将跳过此图: {e}")
+        return None
+"""
+def _download_and_encode_image(url: str) -> str:
+    从 URL 下载图片，缩放，并编码为 Base64 Data URL。
+    try:
+        headers = {'User-Agent': 'MyAnalysisServer/1.0'}
+        logging.info(f"正在从 URL 下载图片: {url}")
+        response = requests.get(url, headers=headers, stream=True, timeout=15)
+        response.raise_for_status()
+        
+        original_image_data = response.content
+        logging.info("图片下载成功，正在处理...")
+        
+        resized_image_data, mime_type = _resize_image(original_image_data)
+        
+        logging.info("图片处理完成，正在进行 Base64 编码...")
+        base64_encoded_string = base64.b64encode(resized_image_data).decode("utf-8")
+        
+        return f"data:{mime_type};base64,{base64_encoded_string}"
+    except requests.exceptions.RequestException as e:
+        raise ModelProcessingError(f"下载图片失败，URL: {url}") from e
+    except Exception as e:
+        # 这会捕获 _resize_image 抛出的 ModelProcessingError
+        raise ModelProcessingError(f"处理图片时发生错误: {e}") from e
+"""
+def _encode_image_source(img_source: ImageSource) -> Optional[str]:
+    # 本地文件内容可能变化，只缓存内存中的数据
+    if isinstance(img_source, bytes):
+        return _encode_image_cached(img_source)
+    return _encode_image_bytes(img_source)
+
+def _build_message_content(prompt: str, image_sources: List[ImageSource]) -> tuple[list, int]:
+    """编码图片并组装消息内容，返回 (content, 有效图片数)。图片编码是 CPU 密集操作"""
+    content = [{"type": "text", "text": prompt}]
+
+    # 在调用方所在的工作线程中逐张编码，不再嵌套提交到另一个线程池；结果可能为 None（无效图片），按原顺序过滤
+    valid_image_urls = [url for url in map(_encode_image_source, image_sources) if url]
+
+    for url in valid_image_urls:
+        content.append(
+            {"type": "image_url", "image_url": {"url": url}}
+        )
+
+    # 如果所有图片都被过滤掉了，打印一条日志
+    if image_sources and not valid_image_urls:
+        logging.warning("警告：此批次的所有图片都因尺寸过小或格式错误而被跳过。")
+        # 如果不希望在这种情况下调用模型，可以在这里直接返回一个提示信息
+        # return "文档单元中的所有图片都无效，无法进行分析。"
+    return content, len(valid_image_urls)
+
+# 按 (api_key, base_url) 复用客户端，底层 httpx 连接池中的 keep-alive 连接得以在各次调用间共享，
+# 不必每次调用都重新建立 TCP/TLS 连接。请求可以携带自定义的密钥和地址，因此只保留最近使用的若干个
+@functools.lru_cache(maxsize=32)
+def _get_client(api_key: str, base_url: str) -> OpenAI:
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+# 异步客户端的连接只能在创建它的事件循环中使用，因此同时按事件循环区分
+@functools.lru_cache(maxsize=32)
+def _get_async_client(loop: asyncio.AbstractEventLoop, api_key: str, base_url: str) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+def _resolve_model_config(kwargs: dict) -> tuple[str, str, str]:
+    """返回 (api_key, base_url, model)，请求参数优先于服务器配置"""
+    final_api_key = kwargs.get('api_key') or settings.OPENAI_API_KEY
+    final_base_url = kwargs.get('base_url') or settings.OPENAI_API_BASE_URL
+    final_model = kwargs.get('model') or settings.MODEL_NAME
+
+    if not final_api_key or not final_base_url:
+        raise ModelProcessingError("API 密钥或基地址未在服务器上配置。")
+    return final_api_key, final_base_url, final_model
+
+# --- 模型响应的磁盘缓存 ---
+# 相同的模型、提示词和图片（例如重复处理同一份文档）直接返回上次的结果，省去耗时且计费的模型调用。
+# 每个结果是一个以请求摘要命名的文本文件，mtime 被设置为其过期时间
+_RESPONSE_CACHE_DIR = os.path.join(settings.TEMP_DIR, "model_cache")
+_RESPONSE_CACHE_SWEEP_INTERVAL = 3600
+_last_response_cache_sweep = 0.0
+
+def _response_cache_key(prompt: str, image_bytes_list: List[bytes] | None, api_key: str, base_url: str, model: str, kwargs: dict) -> str:
+    """
+    请求摘要：覆盖全部请求参数（按键排序），不同参数或不同凭据的请求互不共享结果；
+    密钥只以其摘要参与计算。图片按顺序参与计算，顺序不同的请求被视为不同的请求
+    """
+    params = {key: value for key, value in kwargs.items() if key != 'api_key'}
+    digest = hashlib.sha256()
+    digest.update(hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).digest())
+    for part in (base_url.encode('utf-8'), model.encode('utf-8'),
+                 orjson.dumps(params, option=orjson.OPT_SORT_KEYS, default=str), prompt.encode('utf-8')):
+        digest.update(part)
+        digest.update(b'\0')
+    for image_data in image_bytes_list or []:
+        digest.update(hashlib.blake2b(image_data, digest_size=16).digest())
+    return digest.hexdigest()
+
+def _load_cached_response(key: str) -> Optional[str]:
+    path = os.path.join(_RESPONSE_CACHE_DIR, key)
+    try:
+        if os.path.getmtime(path) > time.time():
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        os.remove(path)
+    except OSError:
+        pass # 缓存不存在或刚被清理
+    return None
+
+def _sweep_response_cache():
+    """删除已过期的缓存文件，每 _RESPONSE_CACHE_SWEEP_INTERVAL 秒最多执行一次"""
+    global _last_response_cache_sweep
+    now = time.time()
+    if now - _last_response_cache_sweep < _RESPONSE_CACHE_SWEEP_INTERVAL:
+        return
+    _last_response_cache_sweep = now
+    for entry in os.scandir(_RESPONSE_CACHE_DIR):
+        try:
+            if not entry.name.endswith('.tmp') and entry.stat().st_mtime <= now:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def _store_cached_response(key: str, text: str):
+    try:
+        os.makedirs(_RESPONSE_CACHE_DIR, exist_ok=True)
+        # 先写入唯一的临时文件再原子替换，并发写入同一结果时互不干扰
+        staging_path = os.path.join(_RESPONSE_CACHE_DIR, f"{key}.{uuid.uuid4().hex}.tmp")
+        with open(staging_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        expires_at = time.time() + settings.MODEL_CACHE_TTL
+        os.utime(staging_path, (expires_at, expires_at))
+        os.replace(staging_path, os.path.join(_RESPONSE_CACHE_DIR, key))
+        _sweep_response_cache()
+    except OSError as e:
+        # 缓存只是优化，写入失败不影响本次结果
+        logging.warning(f"写入模型响应缓存失败，将忽略缓存: {e}")
+
+def _cache_key_for_request(prompt: str, image_bytes_list: List[bytes] | None, image_paths: List[str] | None,
+                           api_key: str, base_url: str, model: str, kwargs: dict) -> Optional[str]:
+    """返回可用于缓存的请求摘要；缓存被禁用或包含本地图片文件（内容可能变化）时返回 None"""
+    if settings.MODEL_CACHE_TTL <= 0 or image_paths:
+        return None
+    return _response_cache_key(prompt, image_bytes_list, api_key, base_url, model, kwargs)
+
+# VVVV  核心修改：函数现在接受一个图片列表 VVVV
+def get_model_response(prompt: str, image_bytes_list: List[bytes] = None, image_paths: List[str] = None, **kwargs) -> str:
+    """
+    主函数，处理文本和一系列二进制图片，并获取模型响应。
+    图片也可以通过 image_paths 以本地文件路径的形式传入，避免调用方先把整个文件读入内存。
+    """
+    final_api_key, final_base_url, final_model = _resolve_model_config(kwargs)
+
+    cache_key = _cache_key_for_request(prompt, image_bytes_list, image_paths, final_api_key, final_base_url, final_model, kwargs)
+    if cache_key and (cached := _load_cached_response(cache_key)) is not None:
+        logging.info(f"命中模型响应缓存，跳过对模型 '{final_model}' 的调用。")
+        return cached
+
+    try:
+        image_sources: List[ImageSource] = [*(image_bytes_list or []), *(image_paths or [])]
+        content, valid_image_count = _build_message_content(prompt, image_sources)
+
+        logging.info(f"向模型 '{final_model}' 发送请求，包含 {valid_image_count} 张有效图片。")
+        
+        client = _get_client(final_api_key, final_base_url)
+        response = client.chat.completions.create(
+            model=final_model,
+            messages=[{"role": "user", "content": content}],
+            max_tokens=kwargs.get('max_tokens', 4096),
+        )
+        logging.info("成功获得模型返回结果。")
+        result = response.choices[0].message.content
+        if cache_key and result:
+            _store_cached_response(cache_key, result)
+        return result
+
+    except ModelProcessingError as e:
+        raise e
+    except Exception as e:
+        logging.error(f"调用模型API时发生未知错误: {e}", exc_info=True)
+        raise ModelProcessingError(f"调用模型API时发生严重错误: {e}") from e
+
+async def aget_model_response(prompt: str, image_bytes_list: List[bytes] = None, image_paths: List[str] = None, **kwargs) -> str:
+    """
+    get_model_response 的异步版本。等待模型返回期间不占用线程，
+    适合大量并发的模型调用；图片编码仍在线程中完成，不阻塞事件循环。
+    """
+    final_api_key, final_base_url, final_model = _resolve_model_config(kwargs)
+
+    # 计算摘要需要对图片做哈希，与读写缓存文件一起放到线程中完成
+    cache_key = await asyncio.to_thread(_cache_key_for_request, prompt, image_bytes_list, image_paths, final_api_key, final_base_url, final_model, kwargs)
+    if cache_key and (cached := await asyncio.to_thread(_load_cached_response, cache_key)) is not None:
+        logging.info(f"命中模型响应缓存，跳过对模型 '{final_model}' 的调用。")
+        return cached
+
+    try:
+        image_sources: List[ImageSource] = [*(image_bytes_list or []), *(image_paths or [])]
+        if image_sources:
+            content, valid_image_count = await asyncio.to_thread(_build_message_content, prompt, image_sources)
+        else:
+            content, valid_image_count = _build_message_content(prompt, image_sources)
+
+        logging.info(f"向模型 '{final_model}' 发送请求，包含 {valid_image_count} 张有效图片。")
+
+        client = _get_async_client(asyncio.get_running_loop(), final_api_key, final_base_url)
+        response = await client.chat.completions.create(
+            model=final_model,
+            messages=[{"role": "user", "content": content}],
+            max_tokens=kwargs.get('max_tokens', 4096),
+        )
+        logging.info("成功获得模型返回结果。")
+        result = response.choices[0].message.content
+        if cache_key and result:
+            await asyncio.to_thread(_store_cached_response, cache_key, result)
+        return result
+
+    except ModelProcessingError as e:
+        raise e
+    except Exception as e:
+        logging.error(f"调用模型API时发生未知错误: {e}", exc_info=True)
+        raise ModelProcessingError(f"调用模型API时发生严重错误: {e}") from e
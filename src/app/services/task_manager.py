@@ -1,10 +1,18 @@
 # src/app/services/task_manager.py
+import asyncio
+import functools
+import heapq
+import inspect
+import math
 import uuid
 import time
 import logging
-from threading import Lock, Timer
+from threading import Lock
+from concurrent.futures import Executor
 from typing import Dict, Any, Callable
+from fastapi.concurrency import run_in_threadpool
 from ..config import settings
+from ..utils import download_util
 
 # --- 任务状态常量 ---
 class TaskStatus:
@@ -13,16 +21,47 @@ class TaskStatus:
     COMPLETED = "completed"
     FAILED = "failed"
 
+class FileResult:
+    """
+    保存在本地文件中的任务结果（如较大的纯文本），内存中只保留路径。
+    查询时由调用方流式读取；任务被清理或淘汰时文件随之删除。
+    """
+    __slots__ = ('path',)
+
+    def __init__(self, path: str):
+        self.path = path
+
+def _discard_result_files(tasks: list[Dict[str, Any]]):
+    """删除已移除任务的结果文件；在 _task_lock 之外调用，避免持锁做文件 IO"""
+    for task in tasks:
+        result = task.get('result')
+        if isinstance(result, FileResult):
+            download_util.cleanup_temp_file(result.path)
+
 # --- 内存中的任务存储 ---
 # 使用线程锁来保证并发访问的安全性
 _task_storage: Dict[str, Dict[str, Any]] = {}
 _task_lock = Lock()
 
+# 终态（COMPLETED/FAILED）任务序列化后的状态响应，结构: task_id -> (过期时间戳, 响应字节)。
+# 与任务记录在同一代码路径中删除（见 _drop_task），任务被清理或提前淘汰后不会再返回旧结果
+_response_cache: Dict[str, tuple[float, bytes]] = {}
+
+# --- 任务过期清理 ---
+# 按过期时间排序的最小堆 (expires_at, task_id)，同样由 _task_lock 保护，
+# 由唯一的后台协程 reap_expired_tasks 统一清理，代替每个任务一个 Timer 线程
+_expiry_heap: list[tuple[float, str]] = []
+_reaper_loop: asyncio.AbstractEventLoop | None = None
+_reaper_wakeup: asyncio.Event | None = None
+
 def create_task() -> str:
     """创建一个新任务，返回其唯一ID"""
     task_id = str(uuid.uuid4())
     with _task_lock:
-        _task_storage[task_id] = {"status": TaskStatus.PENDING, "result": None, "error": None}
+        _task_storage[task_id] = {
+            "status": TaskStatus.PENDING, "result": None, "error": None,
+            "created_at": time.monotonic(),
+        }
     logging.info(f"已创建新任务: {task_id}")
     return task_id
 
@@ -31,39 +70,143 @@ def get_task(task_id: str) -> Dict[str, Any] | None:
     with _task_lock:
         return _task_storage.get(task_id)
 
+def get_tasks(task_ids: list[str]) -> Dict[str, Dict[str, Any] | None]:
+    """批量获取任务信息，只加一次锁；不存在的任务对应 None"""
+    with _task_lock:
+        return {task_id: _task_storage.get(task_id) for task_id in task_ids}
+
+def _drop_task(task_id: str) -> Dict[str, Any] | None:
+    """删除任务记录及其缓存的响应，调用方需持有 _task_lock；返回被删除的任务（不存在时为 None）"""
+    _response_cache.pop(task_id, None)
+    return _task_storage.pop(task_id, None)
+
 def remove_task(task_id: str):
     """当任务完成后，从存储中移除以释放内存"""
+    with _task_lock:
+        task = _drop_task(task_id)
+    if task is not None:
+        _discard_result_files([task])
+        logging.info(f"已按计划清理缓存的任务结果: {task_id}")
+
+def get_cached_response(task_id: str) -> tuple[float, bytes] | None:
+    """获取终态任务缓存的 (过期时间戳, 响应字节)；单次字典读取，无需加锁"""
+    return _response_cache.get(task_id)
+
+def cache_response(task_id: str, expires_at: float, payload: bytes):
+    """缓存终态任务的响应；任务已被清理时不缓存"""
     with _task_lock:
         if task_id in _task_storage:
-            del _task_storage[task_id]
-            logging.info(f"已按计划清理缓存的任务结果: {task_id}")
+            _response_cache[task_id] = (expires_at, payload)
+
+def finish_task(task_id: str, status: str, result: Any = None, error: str | None = None):
+    """
+    将任务标记为终态（COMPLETED 或 FAILED），并从此刻起开始计算结果的保留时长。
+    无论客户端是否再来查询，结果都会在 TASK_RESULT_TTL 秒后被自动清理。
+    """
+    with _task_lock:
+        task = _task_storage.get(task_id)
+        if task is not None:
+            task['status'] = status
+            task['result'] = result
+            task['error'] = error
+            task['expires_at'] = time.monotonic() + settings.TASK_RESULT_TTL
+    if task is None:
+        # 任务已被淘汰，结果文件不会再被读取
+        if isinstance(result, FileResult):
+            download_util.cleanup_temp_file(result.path)
+        return
+    schedule_task_cleanup(task_id, delay_seconds=settings.TASK_RESULT_TTL)
+
+def suggest_poll_interval(task: Dict[str, Any]) -> int:
+    """
+    根据任务已运行的时长，给出客户端下一次轮询前建议等待的秒数。
+    间隔从 QUERY_INITIAL_SLEEP 开始按 QUERY_FACTOR 几何增长，上限为 QUERY_MAX_SLEEP。
+    """
+    age = time.monotonic() - task.get("created_at", time.monotonic())
+    delay = settings.QUERY_INITIAL_SLEEP
+    if age > settings.QUERY_INITIAL_SLEEP:
+        attempt = math.floor(math.log(age / settings.QUERY_INITIAL_SLEEP, settings.QUERY_FACTOR))
+        delay = settings.QUERY_INITIAL_SLEEP * settings.QUERY_FACTOR ** attempt
+    return int(min(delay, settings.QUERY_MAX_SLEEP))
 
 # VVVV 核心修改：添加新的调度函数 VVVV
 def schedule_task_cleanup(task_id: str, delay_seconds: int):
     """
-    创建一个计时器，在指定的秒数后调用 remove_task。
-    这是一个非阻塞操作。
+    登记任务在 delay_seconds 秒后过期，由 reap_expired_tasks 统一清理。
+    这是一个非阻塞操作，可在任意线程中调用。
     """
-    # 1. 创建一个 Timer 对象
-    # 它会在 delay_seconds 秒后，在新的线程中执行 remove_task(task_id)
-    cleanup_timer = Timer(delay_seconds, remove_task, args=[task_id])
-
-    # 2. 将计时器线程设置为守护线程
-    # 这意味着如果主程序退出，这个计时器线程不会阻止程序的关闭
-    cleanup_timer.daemon = True
-    
-    # 3. 启动计时器
-    cleanup_timer.start()
-    
+    expires_at = time.monotonic() + delay_seconds
+    evicted = []
+    with _task_lock:
+        heapq.heappush(_expiry_heap, (expires_at, task_id))
+        # 保留的已结束任务数有上限，突发大量任务时提前清理最早过期的结果，内存占用有界
+        while len(_expiry_heap) > settings.TASK_RESULT_MAX_ENTRIES:
+            _, evicted_id = heapq.heappop(_expiry_heap)
+            task = _drop_task(evicted_id)
+            if task is not None:
+                evicted.append(task)
+                logging.info(f"已结束任务数超过上限，提前清理任务结果: {evicted_id}")
+        is_earliest = bool(_expiry_heap) and _expiry_heap[0][1] == task_id
+    _discard_result_files(evicted)
+
+    # 只有新任务成为最早过期的任务时，才需要唤醒清理协程重新计算等待时间
+    if is_earliest and _reaper_loop is not None and _reaper_wakeup is not None:
+        _reaper_loop.call_soon_threadsafe(_reaper_wakeup.set)
+
     logging.info(f"任务 {task_id} 的结果将缓存 {delay_seconds} 秒后自动清理。")
+
+def _pop_expired_tasks() -> float | None:
+    """删除所有已到期的任务，返回下一个任务的过期时间（堆为空时返回 None）"""
+    now = time.monotonic()
+    expired = []
+    with _task_lock:
+        while _expiry_heap and _expiry_heap[0][0] <= now:
+            _, task_id = heapq.heappop(_expiry_heap)
+            task = _drop_task(task_id)
+            if task is not None:
+                expired.append(task)
+                logging.info(f"已按计划清理缓存的任务结果: {task_id}")
+        next_expiry = _expiry_heap[0][0] if _expiry_heap else None
+    _discard_result_files(expired)
+    return next_expiry
+
+async def reap_expired_tasks():
+    """
+    常驻后台的清理协程，应在应用启动时创建一次。
+    等待到最早的过期时间（或被新登记的更早任务唤醒）后批量删除到期任务。
+    """
+    global _reaper_loop, _reaper_wakeup
+    _reaper_loop = asyncio.get_running_loop()
+    _reaper_wakeup = asyncio.Event()
+
+    try:
+        while True:
+            next_expiry = _pop_expired_tasks()
+            timeout = None if next_expiry is None else max(0.0, next_expiry - time.monotonic())
+            try:
+                async with asyncio.timeout(timeout):
+                    await _reaper_wakeup.wait()
+            except TimeoutError:
+                pass
+            _reaper_wakeup.clear()
+    finally:
+        _reaper_loop = None
+        _reaper_wakeup = None
 # ^^^^ 核心修改 ^^^^
 
 
-def run_task_in_background(task_id: str, target_func: Callable, *args, **kwargs):
+async def run_task_in_background(task_id: str, target_func: Callable, *args, pool: Executor | None = None, **kwargs):
     """
     在后台执行一个目标函数，并包含自动重试逻辑。
     这是旧 server.py 中 task_executor 的重构版本。
+    target_func 既可以是普通函数（放入线程池执行），也可以是 async 函数（直接在事件循环中 await），
+    两者共享同一套重试与状态记录逻辑。
+    pool 指定普通函数使用的线程池（与直接执行模式相同的 IO/CPU 线程池）；未指定时使用 Starlette 的默认线程池。
     """
+    is_async = inspect.iscoroutinefunction(target_func)
+    if not is_async and pool is not None:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(target_func, *args, **kwargs)
     try:
         with _task_lock:
             _task_storage[task_id]["status"] = TaskStatus.PROCESSING
@@ -72,12 +215,15 @@ def run_task_in_background(task_id: str, target_func: Callable, *args, **kwargs)
         for attempt in range(settings.TASK_MAX_RETRIES):
             try:
                 # 运行实际的任务函数
-                result = target_func(*args, **kwargs)
+                if is_async:
+                    result = await target_func(*args, **kwargs)
+                elif pool is not None:
+                    result = await loop.run_in_executor(pool, call)
+                else:
+                    result = await run_in_threadpool(target_func, *args, **kwargs)
                 
                 # 任务成功
-                with _task_lock:
-                    _task_storage[task_id]['status'] = TaskStatus.COMPLETED
-                    _task_storage[task_id]['result'] = result
+                finish_task(task_id, TaskStatus.COMPLETED, result=result)
                 logging.info(f"任务 {task_id} 在尝试 {attempt + 1} 次后成功完成。")
                 return # 成功，退出函数
 
@@ -86,16 +232,17 @@ def run_task_in_background(task_id: str, target_func: Callable, *args, **kwargs)
                 logging.error(f"任务 {task_id} 尝试第 {attempt + 1}/{settings.TASK_MAX_RETRIES} 次失败: {e}", exc_info=is_last_attempt)
                 
                 if not is_last_attempt:
-                    time.sleep(settings.TASK_RETRY_DELAY)
+                    # 重试等待期间不占用工作线程
+                    await asyncio.sleep(settings.TASK_RETRY_DELAY)
                 else:
                     # 达到最大重试次数，将任务标记为最终失败
-                    with _task_lock:
-                        _task_storage[task_id]['status'] = TaskStatus.FAILED
-                        _task_storage[task_id]['error'] = str(e)
+                    finish_task(task_id, TaskStatus.FAILED, error=str(e))
                     return # 失败，退出函数
+    except asyncio.CancelledError:
+        # 应用关闭等情况下任务被取消：记录终态后继续向上传播取消
+        finish_task(task_id, TaskStatus.FAILED, error="任务已被取消。")
+        raise
     except Exception as e:
         # 捕获 run_task_in_background 本身的意外错误
         logging.critical(f"执行任务 {task_id} 的后台处理器发生致命错误: {e}", exc_info=True)
-        with _task_lock:
-            _task_storage[task_id]['status'] = TaskStatus.FAILED
-            _task_storage[task_id]['error'] = "任务执行器发生致命内部错误。"
\ No newline at end of file
+        finish_task(task_id, TaskStatus.FAILED, error="任务执行器发生致命内部错误。")
\ No newline at end of file
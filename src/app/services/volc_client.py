@@ -1,11 +1,23 @@
 # src/app/services/volc_client.py
-import json
-import time
+import asyncio
 import uuid
 import logging
-import requests
+import httpx
+import orjson
 
 from ..config import settings
+from ..utils.http_session import POOL_MAXSIZE
+
+# 模块级共享的异步客户端：提交与轮询请求复用到火山引擎的 keep-alive 连接，
+# 轮询等待期间只是挂起协程，不再为每个转写任务占用一个线程
+_client = httpx.AsyncClient(
+    timeout=10,
+    limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+)
+
+async def aclose():
+    """关闭共享客户端，应在应用关闭时调用"""
+    await _client.aclose()
 
 class TranscriptionError(Exception):
     """自定义语音识别任务异常"""
@@ -13,7 +25,7 @@ class TranscriptionError(Exception):
         super().__init__(message)
         self.details = details
 
-def run_transcription(file_url: str, options: dict) -> dict:
+async def run_transcription(file_url: str, options: dict) -> dict:
     """
     提交并轮询火山语音大模型任务。
     Args:
@@ -23,11 +35,11 @@ def run_transcription(file_url: str, options: dict) -> dict:
     if not settings.VOLC_APPID or not settings.VOLC_TOKEN:
         raise TranscriptionError("服务器未配置火山引擎APPID或TOKEN。")
 
-    task_id, x_tt_logid = _submit_task(file_url, options)
-    result = _poll_for_result(task_id, x_tt_logid)
+    task_id, x_tt_logid = await _submit_task(file_url, options)
+    result = await _poll_for_result(task_id, x_tt_logid)
     return result
 
-def _submit_task(file_url: str, options: dict) -> tuple[str, str]:
+async def _submit_task(file_url: str, options: dict) -> tuple[str, str]:
     task_id = str(uuid.uuid4())
     headers = {
         "X-Api-App-Key": settings.VOLC_APPID,
@@ -53,12 +65,14 @@ def _submit_task(file_url: str, options: dict) -> tuple[str, str]:
     }
 
     logging.info(f"向火山引擎提交语音识别任务，任务ID: {task_id}")
-    logging.debug(f"提交的请求体: {json.dumps(request_payload)}") # 使用 debug 级别记录详细信息
+    # 请求体只序列化一次，日志与发送共用同一份字节
+    body = orjson.dumps(request_payload)
+    logging.debug(f"提交的请求体: {body.decode('utf-8')}") # 使用 debug 级别记录详细信息
 
     try:
-        response = requests.post(settings.VOLC_SUBMIT_URL, data=json.dumps(request_payload), headers=headers, timeout=10)
+        response = await _client.post(settings.VOLC_SUBMIT_URL, content=body, headers=headers)
         response.raise_for_status()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise TranscriptionError("提交任务时发生网络错误", details=str(e))
 
     if response.headers.get("X-Api-Status-Code") == "20000000":
@@ -68,7 +82,7 @@ def _submit_task(file_url: str, options: dict) -> tuple[str, str]:
     else:
         raise TranscriptionError("提交任务失败", details=response.text)
 
-def _poll_for_result(task_id: str, x_tt_logid: str) -> dict:
+async def _poll_for_result(task_id: str, x_tt_logid: str) -> dict:
     # _poll_for_result 函数无需修改，保持原样
     headers = {
         "X-Api-App-Key": settings.VOLC_APPID,
@@ -81,19 +95,19 @@ def _poll_for_result(task_id: str, x_tt_logid: str) -> dict:
         headers["X-Tt-Logid"] = x_tt_logid
         logging.info(f"查询任务状态，任务ID: {task_id}")
         try:
-            query_response = requests.post(settings.VOLC_QUERY_URL, data=json.dumps({}), headers=headers, timeout=10)
+            query_response = await _client.post(settings.VOLC_QUERY_URL, content=b'{}', headers=headers)
             query_response.raise_for_status()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise TranscriptionError("查询任务时发生网络错误", details=str(e))
         x_tt_logid = query_response.headers.get('X-Tt-Logid', x_tt_logid)
         code = query_response.headers.get('X-Api-Status-Code', "")
         if code == '20000000':
             logging.info(f"任务成功完成。Log ID: {x_tt_logid}")
-            return query_response.json()
+            return orjson.loads(query_response.content)
         elif code in ('20000001', '20000002'):
             msg = query_response.headers.get('X-Api-Message', 'In progress')
             logging.info(f"任务进行中 ({msg})... 将在 {current_sleep_time:.1f} 秒后重试。")
-            time.sleep(current_sleep_time)
+            await asyncio.sleep(current_sleep_time)
             current_sleep_time = min(current_sleep_time * settings.QUERY_FACTOR, settings.QUERY_MAX_SLEEP)
         else:
             raise TranscriptionError("语音识别任务失败", details=query_response.text)
\ No newline at end of file
@@ -1,56 +1,59 @@
 # src/app/utils/download_util.py
 
 import os
+import re
+import time
 import uuid
+import shutil
+import threading
+import hashlib
 import logging
 import requests
+from typing import Mapping
 from urllib.parse import urlparse
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 # 从中央配置导入设置
 from ..config import settings
+from .http_session import create_session
 
 class DownloadError(Exception):
     """自定义下载异常"""
     pass
 
-# VVVV  用下面的新函数完全替换旧的 download_file 函数 VVVV
-def download_file(url: str, connect_timeout: int = 10, read_timeout: int = 60) -> tuple[str, str]:
-    """
-    通用的文件下载工具，内置了健壮的重试逻辑。
-    它从 URL 下载文件并将其保存到临时目录。
+# --- 核心修改：模块级共享的、带有重试策略和连接池的会话 ---
+_session = create_session(Retry(
+    total=3,  # 总共重试3次
+    backoff_factor=1,  # 重试间的等待时间会指数增长 (e.g., 0s, 2s, 4s)
+    status_forcelist=[429, 500, 502, 503, 504],  # 对这些服务器错误状态码进行重试
+    allowed_methods=["HEAD", "GET", "OPTIONS"]
+))
 
-    Args:
-        url (str): 要下载的文件的URL。
-        connect_timeout (int): 建立连接的超时时间（秒）。
-        read_timeout (int): 等待服务器发送数据的超时时间（秒）。
+# 按 URL 缓存下载结果的目录，位于 TEMP_DIR 之下
+_CACHE_DIR = os.path.join(settings.TEMP_DIR, "download_cache")
+_MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+_DOWNLOAD_CACHE_SWEEP_INTERVAL = 60
+_last_download_cache_sweep = 0.0
+_download_cache_bytes = 0 # 上次扫描后的缓存总大小加上其后新写入的大小
+_download_cache_lock = threading.Lock()
 
-    Returns:
-        tuple[str, str]: (本地文件路径, 原始文件名)
-    """
+def _filename_from_url(url: str) -> str:
+    """从 URL 解析原始文件名"""
+    parsed_url = urlparse(url)
+    original_filename = os.path.basename(parsed_url.path)
+    if not original_filename:
+        _, extension = os.path.splitext(parsed_url.path)
+        original_filename = f"downloaded_file{extension or '.tmp'}"
+    return original_filename
+
+def _download(url: str, connect_timeout: int, read_timeout: int) -> tuple[str, str, Mapping[str, str]]:
+    """执行实际下载，返回 (本地文件路径, 原始文件名, 响应头)"""
     logging.info(f"通用下载工具: 准备从 {url} 下载文件...")
 
-    # --- 核心修改：配置带有重试策略的会话 ---
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,  # 总共重试3次
-        backoff_factor=1,  # 重试间的等待时间会指数增长 (e.g., 0s, 2s, 4s)
-        status_forcelist=[429, 500, 502, 503, 504],  # 对这些服务器错误状态码进行重试
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    # --- 修改结束 ---
-    
     try:
         # 1. 从 URL 解析原始文件名
-        parsed_url = urlparse(url)
-        original_filename = os.path.basename(parsed_url.path)
-        if not original_filename:
-            _, extension = os.path.splitext(parsed_url.path)
-            original_filename = f"downloaded_file{extension or '.tmp'}"
+        original_filename = _filename_from_url(url)
 
         # 2. 创建一个唯一的本地文件路径
         unique_id = uuid.uuid4()
@@ -58,17 +61,18 @@ def download_file(url: str, connect_timeout: int = 10, read_timeout: int = 60) -
         local_filepath = os.path.join(settings.TEMP_DIR, local_filename)
         os.makedirs(settings.TEMP_DIR, exist_ok=True)
 
-        # 3. 执行下载 (使用配置好的会话和更精细的超时元组)
+        # 3. 执行下载 (使用共享的会话和更精细的超时元组)
         headers = {'User-Agent': 'Model-Server-Downloader/1.0'}
-        # 使用 session.get 替代 requests.get
-        with session.get(url, headers=headers, stream=True, timeout=(connect_timeout, read_timeout)) as r:
+        # 使用共享会话，对同一主机的重复下载可复用已建立的连接
+        with _session.get(url, headers=headers, stream=True, timeout=(connect_timeout, read_timeout)) as r:
             r.raise_for_status()
+            # 直接从底层流按 1 MiB 块复制，避免逐个 8 KiB 块的 Python 循环；decode_content 保证 gzip 等编码仍被解码
+            r.raw.decode_content = True
             with open(local_filepath, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                shutil.copyfileobj(r.raw, f, length=_DOWNLOAD_CHUNK_SIZE)
         
         logging.info(f"文件已成功下载到临时路径: {local_filepath}")
-        return local_filepath, original_filename
+        return local_filepath, original_filename, r.headers
 
     except requests.exceptions.RequestException as e:
         logging.error(f"下载文件时发生网络或HTTP错误: {e}", exc_info=True)
@@ -77,6 +81,120 @@ def download_file(url: str, connect_timeout: int = 10, read_timeout: int = 60) -
         logging.error(f"下载文件时发生未知错误: {e}", exc_info=True)
         raise DownloadError(f"下载时发生未知错误: {e}")
 
+# VVVV  用下面的新函数完全替换旧的 download_file 函数 VVVV
+def download_file(url: str, connect_timeout: int = 10, read_timeout: int = 60) -> tuple[str, str]:
+    """
+    通用的文件下载工具，内置了健壮的重试逻辑。
+    它从 URL 下载文件并将其保存到临时目录。
+
+    Args:
+        url (str): 要下载的文件的URL。
+        connect_timeout (int): 建立连接的超时时间（秒）。
+        read_timeout (int): 等待服务器发送数据的超时时间（秒）。
+
+    Returns:
+        tuple[str, str]: (本地文件路径, 原始文件名)
+    """
+    local_filepath, original_filename, _ = _download(url, connect_timeout, read_timeout)
+    return local_filepath, original_filename
+
+def _cache_ttl(response_headers) -> int:
+    """根据源站的 Cache-Control 决定缓存时长，最长不超过 DOWNLOAD_CACHE_TTL"""
+    cache_control = response_headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = _MAX_AGE_PATTERN.search(cache_control)
+    if match:
+        return min(int(match.group(1)), settings.DOWNLOAD_CACHE_TTL)
+    return settings.DOWNLOAD_CACHE_TTL
+
+def _link_or_copy(src: str, dst: str):
+    """优先使用硬链接（零拷贝），跨文件系统等情况下退化为复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def _evict_download_cache(added_bytes: int):
+    """
+    删除已过期的缓存文件；若总大小仍超过上限，则从最早过期的开始删除。
+    完整扫描每 _DOWNLOAD_CACHE_SWEEP_INTERVAL 秒最多执行一次，期间按新写入的大小累计估算总量，
+    估算超过上限时立即扫描。超过 DOWNLOAD_TIMEOUT 仍未被替换的 .tmp 文件是中断写入的残留，一并删除
+    """
+    global _last_download_cache_sweep, _download_cache_bytes
+    now = time.time()
+    with _download_cache_lock:
+        _download_cache_bytes += added_bytes
+        if now - _last_download_cache_sweep < _DOWNLOAD_CACHE_SWEEP_INTERVAL and _download_cache_bytes <= settings.DOWNLOAD_CACHE_MAX_BYTES:
+            return
+        _last_download_cache_sweep = now
+
+        entries = []
+        total_size = 0
+        for entry in os.scandir(_CACHE_DIR):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue # 已被其他线程替换或清理
+            if entry.name.endswith('.tmp'):
+                # 其他线程正在写入的缓存文件只存在片刻，长时间留下的才清理
+                if now - stat.st_mtime > settings.DOWNLOAD_TIMEOUT:
+                    cleanup_temp_file(entry.path)
+                continue
+            if stat.st_mtime <= now:
+                cleanup_temp_file(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= settings.DOWNLOAD_CACHE_MAX_BYTES:
+                break
+            cleanup_temp_file(path)
+            total_size -= size
+        _download_cache_bytes = total_size
+
+def cached_download(url: str, connect_timeout: int = 10, read_timeout: int = 60) -> tuple[str, str]:
+    """
+    带本地缓存的 download_file：相同 URL 在缓存有效期内不会重复下载。
+
+    返回的路径是缓存文件的一个独立硬链接，调用方仍应像使用 download_file 一样
+    在用完后调用 cleanup_temp_file 清理，这不会影响缓存本身。
+    缓存文件的 mtime 被设置为其过期时间。
+    """
+    original_filename = _filename_from_url(url)
+    cache_key = hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()
+    cache_path = os.path.join(_CACHE_DIR, f"{cache_key}_{original_filename}")
+    local_filepath = os.path.join(settings.TEMP_DIR, f"{uuid.uuid4()}_{original_filename}")
+
+    try:
+        if os.path.getmtime(cache_path) > time.time():
+            _link_or_copy(cache_path, local_filepath)
+            logging.info(f"命中下载缓存，跳过下载: {url}")
+            return local_filepath, original_filename
+    except OSError:
+        pass # 缓存不存在或刚被清理，正常下载
+
+    local_filepath, original_filename, response_headers = _download(url, connect_timeout, read_timeout)
+
+    ttl = _cache_ttl(response_headers)
+    if ttl > 0:
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            # 先链接到唯一的临时名再原子替换，避免并发写入同一缓存文件
+            staging_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            _link_or_copy(local_filepath, staging_path)
+            expires_at = time.time() + ttl
+            os.utime(staging_path, (expires_at, expires_at))
+            os.replace(staging_path, cache_path)
+            _evict_download_cache(os.path.getsize(cache_path))
+        except OSError as e:
+            # 缓存只是优化，写入失败不影响本次下载结果
+            logging.warning(f"写入下载缓存失败，将忽略缓存: {e}")
+
+    return local_filepath, original_filename
+
 def cleanup_temp_file(filepath: str):
     """安全地清理单个临时文件。"""
     if filepath and os.path.exists(filepath):
@@ -0,0 +1,19 @@
+# src/app/utils/http_session.py
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 与 main.py 中 IO 线程池的大小保持一致，保证每个工作线程都能拿到可复用的连接
+POOL_MAXSIZE = 64
+
+def create_session(max_retries: Retry | int = 0) -> requests.Session:
+    """
+    创建一个带连接池的 requests 会话。
+    会话应在模块级别创建并复用，这样对同一主机的后续请求可以沿用 keep-alive 连接，
+    省去每次请求的 TCP/TLS 握手。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=max_retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
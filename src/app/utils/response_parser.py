@@ -1,81 +1,105 @@
 # src/app/utils/response_parser.py
 import logging
+from typing import Iterator
 
-def parse_transcription_output(transcription_result: dict) -> str:
+# 模块级 logger 及其方法在导入时绑定一次，循环中的日志调用不再反复查找 logging 模块属性；
+# 记录仍向上传播到根 logger，沿用 main.py 中配置的格式与处理器
+_log = logging.getLogger(__name__)
+_warn = _log.warning
+_info = _log.info
+_error = _log.error
+
+# 每个分句输出一行；整行一次性格式化，不再拼接中间的 details 字符串
+_LINE_FMT = "Speaker %s [性别: %s, 情绪: %s, 音量: %.2fdB, 语速: %.2f words/s]: %s"
+
+def _to_float(value) -> float | None:
+    """将数值字段转换为浮点数，无法转换时返回 None"""
+    # 接口返回的 JSON 中通常已是数字，先按类型直接返回，避免进入异常处理
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return value
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def _format_utterance(i: int, utterance: dict) -> str | None:
+    """将单个分句格式化为一行带详细信息的文本；文本为空时返回 None"""
+    # 1. 提取基础信息
+    text = utterance.get('text', '').strip()
+    if not text:
+        # 空文本的分句不会输出，无需再解析 additions
+        return None
+    additions = utterance.get('additions', {})
+    
+    # 2. 解析 'additions' 字典中的详细信息，缺失的字段直接取默认值
+    # 接口返回的 additions 总是普通 dict，按精确类型判断即可
+    if type(additions) is dict:
+        speaker = additions.get('speaker', '未知说话人')
+        gender = additions.get('gender', '未知性别')
+        emotion = additions.get('emotion', '未知情绪')
+        
+        # 解析音量与语速，转换为浮点数进行格式化
+        volume_db = _to_float(additions.get('volume', 0.0))
+        if volume_db is None:
+            volume_db = 0.0
+            _warn("解析警告: 第 %d 个分句的 'volume' 值无效: %s", i + 1, additions.get('volume'))
+
+        speech_rate_wps = _to_float(additions.get('speech_rate', 0.0))
+        if speech_rate_wps is None:
+            speech_rate_wps = 0.0
+            _warn("解析警告: 第 %d 个分句的 'speech_rate' 值无效: %s", i + 1, additions.get('speech_rate'))
+    else:
+        _warn("解析警告: 第 %d 个分句的 'additions' 键不存在或格式不正确。", i + 1)
+        speaker, gender, emotion = '未知说话人', '未知性别', '未知情绪'
+        volume_db = speech_rate_wps = 0.0
+
+    # 3. 格式化输出字符串，将所有信息整合
+    return _LINE_FMT % (speaker, gender, emotion, volume_db, speech_rate_wps, text)
+
+def iter_transcription_lines(transcription_result: dict) -> Iterator[str]:
     """
-    健壮地将火山引擎的转写结果解析为带详细信息的纯文本。
-    新增信息包括：说话人性别、情绪、音量和语速。
+    逐行产出转写结果的文本（不含换行符），调用方可以边生成边写入文件或流式响应。
+    与 parse_transcription_output 使用同一套兜底规则：非字典输入产出其字符串表示，
+    没有分句时产出全局文本或提示，结构异常时以一行错误提示结束。
     """
-    if not isinstance(transcription_result, dict):
+    # 安全地获取核心的 utterances 列表；result 只查找一次，缺失或为 null 时视为空。
+    # 输入几乎总是字典，直接调用 .get，只有失败时才按非字典输入处理
+    try:
+        result = transcription_result.get('result') or {}
+    except AttributeError:
         # 如果输入不是预期的字典格式，直接返回其字符串表示形式
-        logging.warning(f"输入格式非字典，将直接返回内容: {transcription_result}")
-        return str(transcription_result)
+        _warn("输入格式非字典，将直接返回内容: %s", transcription_result)
+        yield str(transcription_result)
+        return
 
     try:
-        # 安全地获取核心的 utterances 列表
-        utterances = transcription_result.get('result', {}).get('utterances', [])
+        utterances = result.get('utterances', ())
         
         if not utterances:
-            # 如果没有分句，尝试返回全局文本
-            global_text = transcription_result.get('result', {}).get('text', '未能检测到有效语音内容。')
-            logging.info("未找到分句(utterances)，返回全局文本。")
-            return global_text
+            # 如果没有分句，尝试返回全局文本；全局文本缺失或为空时返回提示
+            _info("未找到分句(utterances)，返回全局文本。")
+            yield result.get('text') or '未能检测到有效语音内容。'
+            return
 
-        formatted_lines = []
+        has_lines = False
         for i, utterance in enumerate(utterances):
-            # --- 这是修改的核心部分 ---
-            
-            # 1. 提取基础信息
-            text = utterance.get('text', '').strip()
-            additions = utterance.get('additions', {})
-            
-            # 2. 设置各项信息的默认值
-            speaker = '未知说话人'
-            gender = '未知性别'
-            emotion = '未知情绪'
-            volume_db = 0.0
-            speech_rate_wps = 0.0
-            
-            # 3. 安全地解析 'additions' 字典中的详细信息
-            if isinstance(additions, dict):
-                speaker = additions.get('speaker', speaker)
-                gender = additions.get('gender', gender)
-                emotion = additions.get('emotion', emotion)
-                
-                # 解析音量，并转换为浮点数进行格式化
-                try:
-                    volume_str = additions.get('volume', '0')
-                    volume_db = float(volume_str)
-                except (ValueError, TypeError):
-                    logging.warning(f"解析警告: 第 {i+1} 个分句的 'volume' 值无效: {additions.get('volume')}")
-
-                # 解析语速，并转换为浮点数进行格式化
-                try:
-                    speech_rate_str = additions.get('speech_rate', '0')
-                    speech_rate_wps = float(speech_rate_str)
-                except (ValueError, TypeError):
-                    logging.warning(f"解析警告: 第 {i+1} 个分句的 'speech_rate' 值无效: {additions.get('speech_rate')}")
-            else:
-                 logging.warning(f"解析警告: 第 {i+1} 个分句的 'additions' 键不存在或格式不正确。")
+            line = _format_utterance(i, utterance)
+            if line is not None:
+                has_lines = True
+                yield line
 
-            # --- 修改结束 ---
+        if not has_lines:
+            yield "解析完成，但未提取到任何有效句子。"
 
-            # 4. 格式化输出字符串，将所有信息整合
-            if text:
-                details = (
-                    f"性别: {gender}, "
-                    f"情绪: {emotion}, "
-                    f"音量: {volume_db:.2f}dB, "
-                    f"语速: {speech_rate_wps:.2f} words/s"
-                )
-                formatted_lines.append(f"Speaker {speaker} [{details}]: {text}")
-        
-        if not formatted_lines:
-            return "解析完成，但未提取到任何有效句子。"
-            
-        return "\n".join(formatted_lines)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        # 只捕获结构不符合预期时会出现的异常；其他异常属于程序错误，继续向上抛出，不被掩盖
+        _error("解析音频转写结果时发生严重错误: %s", e, exc_info=True)
+        yield "解析转写结果时发生内部错误。"
 
-    except Exception as e:
-        # 使用更通用的 Exception 来捕获所有可能的解析错误
-        logging.error(f"解析音频转写结果时发生严重错误: {e}", exc_info=True)
-        return "解析转写结果时发生内部错误。"
\ No newline at end of file
+def parse_transcription_output(transcription_result: dict) -> str:
+    """
+    健壮地将火山引擎的转写结果解析为带详细信息的纯文本。
+    新增信息包括：说话人性别、情绪、音量和语速。
+    """
+    return "\n".join(iter_transcription_lines(transcription_result))